@@ -0,0 +1,101 @@
+"""比較 execute_values upsert 與 COPY 批次載入的寫入速度（rows/sec）。
+
+用法：PG_DSN=postgresql://... python bench_load.py --rows 100000
+      python bench_load.py --clean-only   # 只比較逐筆與批次清洗，不需資料庫
+
+資料寫入暫存表（TEMP TABLE），不會影響 emergence.emergency_calls。
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+
+import psycopg2
+
+import sffd_sync
+
+BENCH_TABLE = "sffd_bench"
+
+def make_records(n):
+    base = datetime(2025, 1, 1)
+    recs = []
+    for i in range(n):
+        ts = base + timedelta(seconds=i * 7)
+        recs.append({
+            "call_number": str(250000000 + i // 2),
+            "unit_id": f"E{i % 2}{i % 40:02d}",
+            "incident_number": str(25000000 + i // 2),
+            "call_type": "Medical Incident" if i % 3 else "Alarms",
+            "call_date": ts.date().isoformat(),
+            "received_dttm": ts.isoformat(),
+            "dispatch_dttm": (ts + timedelta(seconds=50)).isoformat(),
+            "on_scene_dttm": (ts + timedelta(minutes=6)).isoformat(),
+            "battalion": f"B{i % 10:02d}",
+            "station_area": str(i % 44),
+            "priority": str(i % 3 + 1),
+            "number_of_alarms": "1",
+            "data_loaded_at": ts.isoformat(),
+        })
+    return recs
+
+def run(conn, cols, rows, mode, batch):
+    with conn.cursor() as cur:
+        cur.execute(f"TRUNCATE {BENCH_TABLE}")
+    upsert_sql = sffd_sync.make_upsert_sql(cols, table=BENCH_TABLE)
+    merge_sql = sffd_sync.make_merge_sql(cols, table=BENCH_TABLE)
+    start = time.perf_counter()
+    for i in range(0, len(rows), batch):
+        chunk = rows[i:i + batch]
+        if mode == "copy":
+            sffd_sync.copy_rows(conn, chunk, cols, merge_sql)
+        else:
+            sffd_sync.upsert_rows(conn, chunk, upsert_sql)
+    conn.commit()
+    return time.perf_counter() - start
+
+BENCH_TYPES = {
+    "call_date": "date",
+    "received_dttm": "timestamp without time zone",
+    "dispatch_dttm": "timestamp without time zone",
+    "on_scene_dttm": "timestamp without time zone",
+    "data_loaded_at": "timestamp without time zone",
+    "number_of_alarms": "integer",
+}
+
+def bench_clean(recs, batch):
+    cols = list(recs[0])
+    start = time.perf_counter()
+    for r in recs:
+        sffd_sync.clean_record(r, cols)
+    per_record = time.perf_counter() - start
+    start = time.perf_counter()
+    for i in range(0, len(recs), batch):
+        sffd_sync.clean_batch(recs[i:i + batch], cols, BENCH_TYPES)
+    batched = time.perf_counter() - start
+    for name, elapsed in (("record", per_record), ("batch", batched)):
+        print(f"[BENCH] clean {name:<6} {len(recs)} rows in {elapsed:.2f}s = {len(recs) / elapsed:,.0f} rows/sec")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark sffd_sync loaders")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--batch", type=int, default=sffd_sync.BATCH_SIZE)
+    parser.add_argument("--clean-only", action="store_true")
+    args = parser.parse_args()
+
+    if args.clean_only:
+        bench_clean(make_records(args.rows), args.batch)
+        return
+
+    with psycopg2.connect(sffd_sync.PG_DSN) as conn:
+        cols = sffd_sync.load_schema(conn, sffd_sync.TABLE)
+        with conn.cursor() as cur:
+            cur.execute(f"CREATE TEMP TABLE {BENCH_TABLE} (LIKE {sffd_sync.TABLE} INCLUDING DEFAULTS)")
+            cur.execute(f"CREATE UNIQUE INDEX ON {BENCH_TABLE} ({','.join(sffd_sync.PKS)})")
+        sffd_sync.create_stage(conn, table=BENCH_TABLE)
+        types = sffd_sync.load_column_types(conn, sffd_sync.TABLE)
+        rows = sffd_sync.clean_batch(make_records(args.rows), cols, types)
+        for mode in ("upsert", "copy"):
+            elapsed = run(conn, cols, rows, mode, args.batch)
+            print(f"[BENCH] {mode:<6} {len(rows)} rows in {elapsed:.2f}s = {len(rows) / elapsed:,.0f} rows/sec")
+
+if __name__ == "__main__":
+    main()
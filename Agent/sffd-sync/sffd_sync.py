@@ -1,12 +1,29 @@
-import os, requests, json
+import os, requests, json, csv, io, queue, threading, time
+from datetime import date, datetime
 import psycopg2
 from psycopg2.extras import execute_values
+try:
+    import pandas as pd
+except Exception:  # pragma: no cover - pandas 為選用套件
+    pd = None
 
-API = "https://data.sfgov.org/resource/nuek-vuh3.json"
+API = os.getenv("SOCRATA_API", "https://data.sfgov.org/resource/nuek-vuh3.json")
 APP_TOKEN = os.getenv("SOCRATA_APP_TOKEN", "")
 PG_DSN = os.getenv("PG_DSN")
 TABLE = "emergence.emergency_calls"
-PKS   = ["call_number", "unit_id"]   # 主鍵/唯一鍵欄位
+PKS   = ["call_number", "unit_id"]   # 主鍵/唯一鍵欄位（未設定主鍵時的預設值）
+PARTITION_FUNC = "emergence.ensure_emergency_calls_partition"   # 見 sql/migrations/001
+BATCH_SIZE = int(os.getenv("SYNC_BATCH_SIZE", "1000"))
+# upsert: execute_values 逐頁 upsert；copy: COPY 至暫存表後一次合併（適合大量回補）
+LOAD_MODE = os.getenv("SYNC_LOAD_MODE", "upsert")
+STAGE_TABLE = "sffd_stage"
+KEYSET = ["data_loaded_at", "call_number", "unit_id"]   # 分頁排序鍵（需唯一）
+PREFETCH = int(os.getenv("SYNC_PREFETCH", "2"))        # 預先下載的批次數
+CHECKPOINT_TABLE = "emergence.sffd_sync_checkpoint"
+GENERATION_TABLE = "emergence.sync_generation"       # 後端結果快取的版本來源
+ROLLUPS_ENABLED = os.getenv("SYNC_ROLLUPS", "true").lower() not in {"0", "false", "no"}
+ROLLUP_PENDING_TABLE = "emergence.rollup_pending"
+JOB_NAME = os.getenv("SYNC_JOB_NAME", "emergency_calls")
 
 # --------- DB Schema 偵測 ---------
 def load_schema(conn, table=TABLE):
@@ -20,30 +37,363 @@ def load_schema(conn, table=TABLE):
         """, (schema, tbl))
         return [r[0] for r in cur.fetchall()]
 
-def make_upsert_sql(cols, pks=PKS):
+def load_column_types(conn, table=TABLE):
+    """回傳 {欄位: data_type}，供批次清洗做型別轉換"""
+    schema, tbl = table.split(".")
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT column_name, data_type
+            FROM information_schema.columns
+            WHERE table_schema=%s AND table_name=%s
+        """, (schema, tbl))
+        return dict(cur.fetchall())
+
+def load_conflict_key(conn, table=TABLE):
+    """回傳資料表主鍵欄位；分割表的主鍵含 call_date。查無主鍵時使用 PKS"""
+    with conn.cursor() as cur:
+        cur.execute("""
+            SELECT a.attname
+            FROM pg_index i
+            JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+            WHERE i.indrelid = %s::regclass AND i.indisprimary
+            ORDER BY array_position(i.indkey::int2[], a.attnum)
+        """, (table,))
+        return [r[0] for r in cur.fetchall()] or PKS
+
+def is_partitioned(conn, table=TABLE):
+    with conn.cursor() as cur:
+        cur.execute("SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass)", (table,))
+        return cur.fetchone()[0]
+
+def drop_null_keys(rows, cols, pks):
+    """主鍵欄位不可為 NULL（與 migration 相同略過這些資料），否則整批寫入失敗、checkpoint 會一直重試"""
+    idx = [cols.index(k) for k in pks if k in cols]
+    kept = [r for r in rows if all(r[i] is not None for i in idx)]
+    return kept, len(rows) - len(kept)
+
+def ensure_partitions(conn, rows, cols):
+    """寫入前建立本批資料所需的月分割表"""
+    idx = cols.index("call_date")
+    months = {str(r[idx])[:7] for r in rows if r[idx] is not None}
+    with conn.cursor() as cur:
+        for m in sorted(months):
+            cur.execute(f"SELECT {PARTITION_FUNC}(%s::date)", (f"{m}-01",))
+
+def make_upsert_sql(cols, pks=PKS, table=TABLE):
     insert_cols = ",".join(cols)
     updates = ",".join([f"{c}=EXCLUDED.{c}" for c in cols if c not in pks])
     return f"""
-    INSERT INTO {TABLE} ({insert_cols})
+    INSERT INTO {table} ({insert_cols})
     VALUES %s
     ON CONFLICT ({",".join(pks)}) DO UPDATE SET
     {updates};
     """
 
+def make_merge_sql(cols, pks=PKS, table=TABLE, stage=STAGE_TABLE):
+    insert_cols = ",".join(cols)
+    updates = ",".join([f"{c}=EXCLUDED.{c}" for c in cols if c not in pks])
+    # 同一批次可能含重複主鍵，ON CONFLICT 不能更新同一列兩次，只保留最後一筆
+    return f"""
+    INSERT INTO {table} ({insert_cols})
+    SELECT DISTINCT ON ({",".join(pks)}) {insert_cols}
+    FROM {stage}
+    ORDER BY {",".join(pks)}, _seq DESC
+    ON CONFLICT ({",".join(pks)}) DO UPDATE SET
+    {updates};
+    """
+
+# --------- 寫入 ---------
+def upsert_rows(conn, rows, upsert_sql):
+    with conn.cursor() as cur:
+        execute_values(cur, upsert_sql, rows, page_size=500)
+
+def create_stage(conn, table=TABLE, stage=STAGE_TABLE):
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            CREATE TEMP TABLE IF NOT EXISTS {stage}
+            (LIKE {table} INCLUDING DEFAULTS)
+        """)
+        cur.execute(f"ALTER TABLE {stage} ADD COLUMN IF NOT EXISTS _seq BIGSERIAL")
+
+def copy_rows(conn, rows, cols, merge_sql, stage=STAGE_TABLE):
+    """以 COPY FROM STDIN 串流寫入暫存表，再用單一 INSERT ... ON CONFLICT 合併"""
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerows(rows)          # None 寫成未加引號的空字串，COPY 視為 NULL
+    buf.seek(0)
+    with conn.cursor() as cur:
+        cur.execute(f"TRUNCATE {stage}")
+        cur.copy_expert(
+            f"COPY {stage} ({','.join(cols)}) FROM STDIN WITH (FORMAT csv)", buf
+        )
+        cur.execute(merge_sql)
+
+# --------- Checkpoint ---------
+def try_job_lock(conn, job=JOB_NAME):
+    """取得此 job 的 session 層級 advisory lock，避免 cron 排程重疊執行；連線關閉時自動釋放"""
+    with conn.cursor() as cur:
+        cur.execute("SELECT pg_try_advisory_lock(hashtext('sffd_sync'), hashtext(%s))", (job,))
+        locked = cur.fetchone()[0]
+    conn.commit()
+    return locked
+
+def ensure_checkpoint_table(conn):
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {CHECKPOINT_TABLE} (
+                job TEXT PRIMARY KEY,
+                status TEXT NOT NULL,              -- running：未完成（可續傳）/ done
+                last_data_loaded_at TEXT,
+                last_call_number TEXT,
+                last_unit_id TEXT,
+                rows_synced BIGINT NOT NULL DEFAULT 0,
+                fetch_seconds DOUBLE PRECISION NOT NULL DEFAULT 0,
+                write_seconds DOUBLE PRECISION NOT NULL DEFAULT 0,
+                duration_seconds DOUBLE PRECISION NOT NULL DEFAULT 0,
+                started_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            )
+        """)
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {GENERATION_TABLE} (
+                job TEXT PRIMARY KEY,
+                generation BIGINT NOT NULL DEFAULT 0,
+                updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            )
+        """)
+    conn.commit()
+
+def bump_generation(conn, job=JOB_NAME):
+    """資料或彙總表變動時在同一交易中呼叫，commit 後後端即會清空結果快取"""
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            INSERT INTO {GENERATION_TABLE} AS g (job, generation) VALUES (%s, 1)
+            ON CONFLICT (job) DO UPDATE SET generation=g.generation + 1, updated_at=now()
+        """, (job,))
+
+def load_checkpoint(conn, job=JOB_NAME):
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            SELECT status, last_data_loaded_at, last_call_number, last_unit_id,
+                   rows_synced, fetch_seconds, write_seconds, duration_seconds
+            FROM {CHECKPOINT_TABLE} WHERE job=%s
+        """, (job,))
+        row = cur.fetchone()
+    if row is None:
+        return None
+    return {
+        "status": row[0],
+        "key": tuple(row[1:4]),
+        "rows": row[4],
+        "fetch": row[5],
+        "write": row[6],
+        "duration": row[7],
+    }
+
+def save_checkpoint(conn, key, stats, status="running", job=JOB_NAME, new_run=False):
+    """與該批資料在同一交易中寫入，commit 後兩者一致"""
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            INSERT INTO {CHECKPOINT_TABLE} AS c
+                (job, status, last_data_loaded_at, last_call_number, last_unit_id,
+                 rows_synced, fetch_seconds, write_seconds, duration_seconds)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+            ON CONFLICT (job) DO UPDATE SET
+                status=EXCLUDED.status,
+                last_data_loaded_at=EXCLUDED.last_data_loaded_at,
+                last_call_number=EXCLUDED.last_call_number,
+                last_unit_id=EXCLUDED.last_unit_id,
+                rows_synced=EXCLUDED.rows_synced,
+                fetch_seconds=EXCLUDED.fetch_seconds,
+                write_seconds=EXCLUDED.write_seconds,
+                duration_seconds=EXCLUDED.duration_seconds,
+                started_at=CASE WHEN %s THEN now() ELSE c.started_at END,
+                updated_at=now()
+        """, (job, status, *key, stats["rows"], stats["fetch"], stats["write"], stats["duration"], new_run))
+
+# --------- 彙總表（rollup） ---------
+# 依 call_date 增量重算：刪除受影響日期後重新彙總，{where} 為空字串時全量重建
+ROLLUPS = {
+    "emergence.calls_daily": {
+        "ddl": """
+            call_date DATE NOT NULL,
+            call_type TEXT,
+            battalion TEXT,
+            station_area TEXT,
+            priority TEXT,
+            call_count BIGINT NOT NULL
+        """,
+        "select": """
+            SELECT call_date, call_type, battalion, station_area, priority, count(*)
+            FROM {table}
+            WHERE call_date IS NOT NULL {where}
+            GROUP BY call_date, call_type, battalion, station_area, priority
+        """,
+    },
+    "emergence.response_times_daily": {
+        "ddl": """
+            call_date DATE NOT NULL,
+            call_type TEXT,
+            battalion TEXT,
+            call_count BIGINT NOT NULL,
+            avg_response_seconds DOUBLE PRECISION,
+            p50_response_seconds DOUBLE PRECISION,
+            p90_response_seconds DOUBLE PRECISION
+        """,
+        "select": """
+            SELECT call_date, call_type, battalion, count(*),
+                   avg(secs),
+                   percentile_cont(0.5) WITHIN GROUP (ORDER BY secs),
+                   percentile_cont(0.9) WITHIN GROUP (ORDER BY secs)
+            FROM (
+                SELECT call_date, call_type, battalion,
+                       extract(epoch FROM on_scene_dttm - received_dttm) AS secs
+                FROM {table}
+                WHERE call_date IS NOT NULL AND on_scene_dttm >= received_dttm {where}
+            ) t
+            GROUP BY call_date, call_type, battalion
+        """,
+    },
+}
+
+def ensure_rollups(conn):
+    """建立彙總表，回傳仍為空（需全量回補）的表名"""
+    empty = []
+    with conn.cursor() as cur:
+        cur.execute(f"CREATE TABLE IF NOT EXISTS {ROLLUP_PENDING_TABLE} (call_date DATE PRIMARY KEY)")
+        for name, spec in ROLLUPS.items():
+            tbl = name.split(".")[1]
+            cur.execute(f"CREATE TABLE IF NOT EXISTS {name} ({spec['ddl']})")
+            cur.execute(f"CREATE INDEX IF NOT EXISTS {tbl}_call_date_idx ON {name} (call_date)")
+            cur.execute(f"SELECT NOT EXISTS (SELECT 1 FROM {name})")
+            if cur.fetchone()[0]:
+                empty.append(name)
+    conn.commit()
+    return empty
+
+def mark_rollup_dates(conn, rows, cols):
+    """記下本批影響的日期；與資料同一交易 commit，中斷後續傳仍會重算"""
+    idx = cols.index("call_date")
+    dates = {r[idx] for r in rows if r[idx] is not None}
+    if not dates:
+        return
+    with conn.cursor() as cur:
+        execute_values(cur,
+            f"INSERT INTO {ROLLUP_PENDING_TABLE} (call_date) VALUES %s ON CONFLICT DO NOTHING",
+            [(d,) for d in dates])
+
+def refresh_rollups(conn, names=ROLLUPS, dates=None, table=TABLE):
+    """dates 為 None 時全量重建，否則只重算這些日期"""
+    where = "" if dates is None else "AND call_date = ANY(%s::date[])"
+    params = None if dates is None else (list(dates),)
+    with conn.cursor() as cur:
+        for name in names:
+            if dates is None:
+                cur.execute(f"TRUNCATE {name}")
+            else:
+                cur.execute(f"DELETE FROM {name} WHERE call_date = ANY(%s::date[])", params)
+            cur.execute(f"INSERT INTO {name} " + ROLLUPS[name]["select"].format(table=table, where=where), params)
+
+def refresh_pending_rollups(conn, rebuild=()):
+    with conn.cursor() as cur:
+        cur.execute(f"SELECT call_date FROM {ROLLUP_PENDING_TABLE}")
+        dates = [r[0] for r in cur.fetchall()]
+    if rebuild:
+        refresh_rollups(conn, names=rebuild)
+    rest = [n for n in ROLLUPS if n not in rebuild]
+    if dates and rest:
+        refresh_rollups(conn, names=rest, dates=dates)
+    with conn.cursor() as cur:
+        cur.execute(f"DELETE FROM {ROLLUP_PENDING_TABLE} WHERE call_date = ANY(%s::date[])", (dates,))
+    if dates or rebuild:
+        # 資料批次 commit 後、重算前可能已快取舊的彙總值，重算完成需再推進版本
+        bump_generation(conn)
+    conn.commit()
+    return len(dates)
+
 # --------- API 拉資料 ---------
-def fetch_batch(since=None, limit=1000, offset=0):
+SESSION = requests.Session()        # 重用 keep-alive 連線
+
+def soql_str(v):
+    return "'" + str(v).replace("'", "''") + "'"
+
+def keyset_after(keys, values):
+    """排在 values 之後的條件（對應 $order 的 ASC NULL LAST）；沒有更後面的資料時回傳 None"""
+    k, v = keys[0], values[0]
+    tail = keyset_after(keys[1:], values[1:]) if len(keys) > 1 else None
+    if v is None:
+        return f"({k} IS NULL AND {tail})" if tail else None
+    cond = f"{k} > {soql_str(v)} OR {k} IS NULL"
+    if tail:
+        cond += f" OR ({k} = {soql_str(v)} AND {tail})"
+    return f"({cond})"
+
+def keyset_where(cursor, inclusive=False):
+    """cursor = (data_loaded_at, call_number, unit_id)
+    inclusive=True：從 cursor 的 data_loaded_at（含）開始，只用於首次同步的起點；
+    否則取排在 cursor 這筆之後的資料（欄位可為 None）"""
+    if inclusive:
+        return f"data_loaded_at >= {soql_str(cursor[0])}"
+    return keyset_after(KEYSET, cursor)
+
+def record_key(rec):
+    return tuple(rec.get(k) for k in KEYSET)
+
+def fetch_batch(cursor=None, limit=1000, session=SESSION, inclusive=False):
     params = {
       "$limit": limit,
-      "$offset": offset,
-      "$order": "data_loaded_at ASC"
+      # NULL 位置須明確指定，與 keyset_after 的比較條件一致
+      "$order": ", ".join(f"{k} ASC NULL LAST" for k in KEYSET)
     }
-    if since:
-        params["$where"] = f"data_loaded_at > '{since}'"
+    if cursor:
+        where = keyset_where(cursor, inclusive)
+        if where is None:
+            return []
+        params["$where"] = where
     headers = {"X-App-Token": APP_TOKEN} if APP_TOKEN else {}
-    r = requests.get(API, params=params, headers=headers, timeout=60)
+    r = session.get(API, params=params, headers=headers, timeout=60)
     r.raise_for_status()
     return r.json()
 
+def iter_batches(cursor, limit=1000, prefetch=PREFETCH, inclusive=False):
+    """背景執行緒依 keyset 連續下載，讓 HTTP 下載與清洗、寫入 DB 重疊進行
+    inclusive 只套用於第一頁，之後一律從上一頁最後一筆之後接續"""
+    q = queue.Queue(maxsize=max(prefetch, 1))
+    stop = threading.Event()
+
+    def producer():
+        cur, incl = cursor, inclusive
+        try:
+            while not stop.is_set():
+                batch = fetch_batch(cursor=cur, limit=limit, inclusive=incl)
+                q.put(batch)
+                if len(batch) < limit:
+                    break
+                cur, incl = record_key(batch[-1]), False
+            q.put(None)
+        except Exception as e:       # 例外交由主執行緒拋出
+            q.put(e)
+
+    t = threading.Thread(target=producer, daemon=True)
+    t.start()
+    try:
+        while True:
+            item = q.get()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            if item:
+                yield item
+    finally:
+        stop.set()
+        # 讓卡在 q.put 的 producer 得以結束
+        while t.is_alive():
+            try:
+                q.get_nowait()
+            except queue.Empty:
+                t.join(0.1)
+
 # --------- 清洗 ---------
 def clean_value(v):
     if v is None:
@@ -61,35 +411,186 @@ def clean_record(rec, cols):
     rec = {k.lower().replace(" ", "_"): clean_value(v) for k,v in rec.items()}
     return [clean_value(rec.get(c)) for c in cols]
 
+# --------- 批次（欄式）清洗 ---------
+def _to_timestamp(v):
+    try:
+        return datetime.fromisoformat(v)
+    except ValueError:
+        return v                    # 無法解析時保留原字串，交由 PostgreSQL 判斷
+
+def _to_date(v):
+    try:
+        return date.fromisoformat(v[:10])
+    except ValueError:
+        return v
+
+def _to_int(v):
+    try:
+        return int(v)
+    except ValueError:
+        try:
+            return int(float(v))
+        except ValueError:
+            return v
+
+CONVERTERS = {
+    "timestamp without time zone": _to_timestamp,
+    "timestamp with time zone": _to_timestamp,
+    "date": _to_date,
+    "integer": _to_int,
+    "bigint": _to_int,
+    "smallint": _to_int,
+}
+
+def _clean_column(values, data_type):
+    # 字串為絕大多數情況，直接內聯處理以省下函式呼叫
+    values = [(v.strip() or None) if type(v) is str else clean_value(v) for v in values]
+    conv = CONVERTERS.get(data_type)
+    if conv is None:
+        return values
+    if pd is not None and data_type.startswith("timestamp"):
+        # 有 pandas 時整欄一次解析；NaT 代表空值或無法解析，交回逐筆轉換
+        parsed = pd.to_datetime(pd.Series(values, dtype="object"), format="ISO8601", errors="coerce")
+        return [conv(v) if pd.isna(ts) and v is not None else (None if v is None else ts.to_pydatetime())
+                for ts, v in zip(parsed, values)]
+    return [None if v is None else conv(v) for v in values]
+
+# 匯入時預先計算的時間差欄位（秒）：欄位 -> (起, 迄)，見 sql/migrations/002
+DERIVED_DURATIONS = {
+    "dispatch_delay_seconds": ("received_dttm", "dispatch_dttm"),
+    "travel_seconds": ("response_dttm", "on_scene_dttm"),
+    "on_scene_to_transport_seconds": ("on_scene_dttm", "transport_dttm"),
+    "response_seconds": ("received_dttm", "on_scene_dttm"),
+}
+
+def _durations(starts, ends):
+    """逐列計算 end - start 秒數；缺值、非時間或順序顛倒時為 None"""
+    out = []
+    for s, e in zip(starts, ends):
+        if type(s) is datetime and type(e) is datetime and e >= s:
+            out.append((e - s).total_seconds())
+        else:
+            out.append(None)
+    return out
+
+def clean_batch(records, cols, types=None):
+    """欄位對應每批只計算一次，逐欄清洗並依 DB 型別轉換，回傳 tuple 列"""
+    types = types or {}
+    mapping = {}                                    # 原始 key -> 目標欄位
+    for rec in records:
+        for k in rec:
+            if k not in mapping:
+                mapping[k] = k.lower().replace(" ", "_")
+    sources = {c: [k for k, n in mapping.items() if n == c] for c in cols}
+    columns = []
+    for c in cols:
+        keys = sources[c]
+        if not keys:
+            columns.append([None] * len(records))
+            continue
+        if len(keys) == 1:
+            k = keys[0]
+            values = [rec.get(k) for rec in records]
+        else:
+            values = [next((rec[k] for k in keys if rec.get(k) is not None), None) for rec in records]
+        columns.append(_clean_column(values, types.get(c)))
+    index = {c: i for i, c in enumerate(cols)}
+    for c, (start, end) in DERIVED_DURATIONS.items():
+        if c in index and start in index and end in index:
+            columns[index[c]] = _durations(columns[index[start]], columns[index[end]])
+    return list(zip(*columns)) if columns else [() for _ in records]
+
 # --------- Main ---------
+def format_metrics(stats):
+    rate = stats["rows"] / stats["duration"] if stats["duration"] else 0.0
+    return (f"rows={stats['rows']} rate={rate:,.0f} rows/s "
+            f"fetch={stats['fetch']:.2f}s write={stats['write']:.2f}s total={stats['duration']:.2f}s")
+
 def main():
     with psycopg2.connect(PG_DSN) as conn:
+        if not try_job_lock(conn):
+            print(f"[WARN] Sync job {JOB_NAME} is already running, skipping this run")
+            return
         cols = load_schema(conn, TABLE)
-        UPSERT_SQL = make_upsert_sql(cols, PKS)
+        types = load_column_types(conn, TABLE)
+        pks = load_conflict_key(conn, TABLE)
+        partitioned = is_partitioned(conn, TABLE)
+        UPSERT_SQL = make_upsert_sql(cols, pks)
+        if LOAD_MODE == "copy":
+            create_stage(conn)
+            MERGE_SQL = make_merge_sql(cols, pks)
+        ensure_checkpoint_table(conn)
+        empty_rollups = ensure_rollups(conn) if ROLLUPS_ENABLED else []
 
-        # 找出 DB 已有的最新 data_loaded_at
-        with conn.cursor() as cur:
-            cur.execute(f"SELECT coalesce(max(data_loaded_at), '2000-01-01') FROM {TABLE};")
-            last_ts = cur.fetchone()[0].isoformat()
-
-        print(f"[INFO] Last timestamp in DB = {last_ts}")
+        checkpoint = load_checkpoint(conn)
+        if checkpoint and checkpoint["status"] == "running":
+            # 上次同步中斷：從最後一筆已 commit 的 keyset 接續，統計值累加
+            cursor = checkpoint["key"]
+            inclusive = False
+            stats = {k: checkpoint[k] for k in ("rows", "fetch", "write", "duration")}
+            new_run = False
+            print(f"[INFO] Resuming from checkpoint {cursor} ({format_metrics(stats)})")
+        else:
+            # 找出 DB 已有的最新 data_loaded_at
+            with conn.cursor() as cur:
+                cur.execute(f"SELECT coalesce(max(data_loaded_at), '2000-01-01') FROM {TABLE};")
+                last_ts = cur.fetchone()[0].isoformat()
+            conn.commit()
+            print(f"[INFO] Last timestamp in DB = {last_ts}")
+            # 從最新時間點（含）開始，時間相同的資料重新 upsert 不會重複
+            cursor = (last_ts, None, None)
+            inclusive = True
+            stats = {"rows": 0, "fetch": 0.0, "write": 0.0, "duration": 0.0}
+            new_run = True
 
-        offset = 0
-        total_upserts = 0
+        # 每批各自 commit，並在同一交易中更新 checkpoint，中斷後可從最後一批續傳
+        batches = iter_batches(cursor, limit=BATCH_SIZE, inclusive=inclusive)
+        run_start = time.perf_counter()
+        base_duration = stats["duration"]
         while True:
-            batch = fetch_batch(since=last_ts, limit=1000, offset=offset)
-            if not batch:
+            t0 = time.perf_counter()
+            batch = next(batches, None)
+            fetch_s = time.perf_counter() - t0
+            stats["fetch"] += fetch_s
+            if batch is None:
                 break
 
-            rows = [clean_record(x, cols) for x in batch]
-            with conn.cursor() as cur:
-                execute_values(cur, UPSERT_SQL, rows, page_size=500)
+            t0 = time.perf_counter()
+            rows = clean_batch(batch, cols, types)
+            rows, skipped = drop_null_keys(rows, cols, pks)
+            if skipped:
+                print(f"[WARN] Skipped {skipped} rows with NULL {'/'.join(pks)}")
+            if partitioned:
+                ensure_partitions(conn, rows, cols)
+            if LOAD_MODE == "copy":
+                copy_rows(conn, rows, cols, MERGE_SQL)
+            else:
+                upsert_rows(conn, rows, UPSERT_SQL)
+            if ROLLUPS_ENABLED:
+                mark_rollup_dates(conn, rows, cols)
+            write_s = time.perf_counter() - t0
+            cursor = record_key(batch[-1])
+            stats["rows"] += len(rows)
+            stats["write"] += write_s
+            stats["duration"] = base_duration + time.perf_counter() - run_start
+            bump_generation(conn)
+            save_checkpoint(conn, cursor, stats, new_run=new_run)
+            conn.commit()
+            new_run = False
+
+            print(f"[INFO] Upserted {len(rows)} rows (cursor={cursor}) "
+                  f"fetch={fetch_s:.2f}s write={write_s:.2f}s | {format_metrics(stats)}")
 
-            total_upserts += len(rows)
-            offset += len(batch)
-            print(f"[INFO] Upserted {len(rows)} rows (offset={offset})")
+        stats["duration"] = base_duration + time.perf_counter() - run_start
+        save_checkpoint(conn, cursor, stats, status="done", new_run=new_run)
+        conn.commit()
+        print(f"[INFO] Sync done: {format_metrics(stats)}")
 
-        print(f"[INFO] Total upserted rows = {total_upserts}")
+        if ROLLUPS_ENABLED:
+            t0 = time.perf_counter()
+            days = refresh_pending_rollups(conn, empty_rollups)
+            rebuilt = f", rebuilt {', '.join(empty_rollups)}" if empty_rollups else ""
+            print(f"[INFO] Refreshed rollups for {days} day(s){rebuilt} in {time.perf_counter() - t0:.2f}s")
 
 if __name__ == "__main__":
     try:
@@ -1,29 +1,74 @@
 """Utilities for generating natural language answers via LLM."""
 
 import json
-import os
-from urllib import request as urlrequest
-from dotenv import load_dotenv
+import re
+from typing import AsyncIterator
+import llm_client
 import prompt_templates
 
-load_dotenv(dotenv_path="../.env")
 
-OLLAMA_URL = os.getenv("OLLAMA_URL")
+def _rows_text(results: list[dict]) -> str:
+    # Limit the amount of data sent to the LLM to the first rows
+    limited_results = (
+        results[:prompt_templates.ANSWER_RESULT_ROWS] if isinstance(results, list) else results
+    )
+    return json.dumps(limited_results, ensure_ascii=False, default=str)
+
+
+def _build_prompt(
+    question: str, results: list[dict], model: str, task: str = "nlp", **extra: str
+) -> str:
+    template = prompt_templates.load_template(model, task)
+    return prompt_templates.fill_template(template, question, results=_rows_text(results), **extra)
+
 
-def generate_answer(question: str, results: list[dict], *, model: str = "llama3.2:3b") -> str:
+async def generate_answer(question: str, results: list[dict], *, model: str = "llama3.2:3b") -> str:
     """Generate a friendly natural language answer using an LLM."""
-    template = prompt_templates.load_template(model, "nlp")
-    # Limit the amount of data sent to the LLM to the first 20 rows
-    limited_results = results[:20] if isinstance(results, list) else results
-    results_text = json.dumps(limited_results, ensure_ascii=False)
-    prompt = prompt_templates.fill_template(template, question, results=results_text)
-    req = urlrequest.Request(
-        OLLAMA_URL,
-        data=json.dumps({"model": model, "prompt": prompt, "stream": False}).encode(),
-        headers={"Content-Type": "application/json"},
-        method="POST",
-    )
-    with urlrequest.urlopen(req) as resp:
-        text = resp.read().decode()
-    data = json.loads(text)
-    return data.get("response", "").strip()
+    prompt = _build_prompt(question, results, model)
+    text = await llm_client.generate(model, prompt)
+    return text.strip()
+
+
+COMBINED_RE = re.compile(r"摘要[:：]\s*(.*?)\s*說明[:：]\s*(.*)", re.DOTALL)
+SENTENCE_END_RE = re.compile(r"[。！？!?\n]|\.(?:\s|$)")
+
+
+def derive_summary(answer: str, max_chars: int = 200) -> str:
+    """Return the first sentence of ``answer`` for use as a summary."""
+    answer = answer.strip()
+    match = SENTENCE_END_RE.search(answer)
+    summary = answer[:match.end()].strip() if match else answer
+    return summary[:max_chars]
+
+
+async def generate_combined_answer(
+    question: str,
+    results: list[dict],
+    *,
+    model: str = "llama3.2:3b",
+    reference: list[dict] | None = None,
+) -> tuple[str, str]:
+    """Return ``(summary, answer)`` produced by a single LLM generation.
+
+    The summary describes ``results``; when ``reference`` is given the answer
+    is grounded on it instead. If the model ignores the requested format the
+    summary is derived from the first sentence of the answer.
+    """
+    section = ""
+    if reference is not None:
+        section = prompt_templates.NLP_COMBINED_REFERENCE.format(rows=_rows_text(reference))
+    prompt = _build_prompt(question, results, model, task="nlp_combined", reference=section)
+    text = (await llm_client.generate(model, prompt)).strip()
+    match = COMBINED_RE.search(text)
+    if match:
+        return match.group(1).strip(), match.group(2).strip()
+    return derive_summary(text), text
+
+
+async def generate_answer_stream(
+    question: str, results: list[dict], *, model: str = "llama3.2:3b"
+) -> AsyncIterator[str]:
+    """Yield the answer text incrementally as the LLM produces it."""
+    prompt = _build_prompt(question, results, model)
+    async for token in llm_client.generate_stream(model, prompt):
+        yield token
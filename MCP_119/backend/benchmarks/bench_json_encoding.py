@@ -0,0 +1,79 @@
+"""Compare JSON encode time of query responses for different row counts.
+
+Run from the backend directory::
+
+    python benchmarks/bench_json_encoding.py --rows 1000 10000 100000
+
+"stdlib" reproduces FastAPI's default path (jsonable_encoder followed by
+json.dumps); "jsonrpc" is ``jsonrpc.dumps`` as used by JSONRPCResponse, which
+uses orjson when it is installed.
+"""
+
+import argparse
+import datetime
+import decimal
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+
+import jsonrpc  # noqa: E402
+
+
+def _make_rows(count: int) -> list[dict]:
+    """Return rows shaped like emergency_calls with date, timestamp and interval columns."""
+    base = datetime.datetime(2025, 5, 12, 8, 30)
+    rows = []
+    for i in range(count):
+        received = base + datetime.timedelta(minutes=i)
+        rows.append({
+            "call_number": f"25{i:07d}",
+            "unit_id": f"E{i % 50:02d}",
+            "call_type": "Medical Incident",
+            "call_date": received.date(),
+            "received_dttm": received,
+            "dispatch_dttm": received + datetime.timedelta(seconds=45),
+            "on_scene_dttm": received + datetime.timedelta(minutes=6),
+            "battalion": f"B{i % 10:02d}",
+            "station_area": str(i % 44),
+            "priority": "3",
+            "number_of_alarms": 1,
+            "response_minutes": decimal.Decimal("6.25"),
+            "response_time": datetime.timedelta(minutes=6),
+        })
+    return rows
+
+
+def _time(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    backend = "orjson" if jsonrpc.orjson is not None else "stdlib fallback"
+    print(f"jsonrpc.dumps backend: {backend}")
+    for count in args.rows:
+        payload = jsonrpc.build_response(result={"results": _make_rows(count)})
+        stdlib = _time(lambda: json.dumps(jsonable_encoder(payload)).encode(), args.repeat)
+        fast = _time(lambda: jsonrpc.dumps(payload), args.repeat)
+        print(
+            f"{count:>7} rows  stdlib={stdlib * 1000:8.1f}ms  "
+            f"jsonrpc={fast * 1000:8.1f}ms  speedup={stdlib / fast:5.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Compare typical chart queries on the raw table against the rollup tables.
+
+Run from the backend directory with ``DATABASE_URL`` pointing at a database
+that the sffd-sync agent has populated::
+
+    python benchmarks/bench_rollups.py --runs 5
+
+Each pair returns the same aggregates; the result cache and the SQL guard are
+bypassed so every run reaches PostgreSQL with the query as written.
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database  # noqa: E402
+
+RAW = "emergence.emergency_calls"
+
+QUERIES = {
+    "count by call_type": (
+        f"SELECT call_type, COUNT(*) AS n FROM {RAW} GROUP BY call_type ORDER BY n DESC",
+        "SELECT call_type, SUM(call_count) AS n FROM emergence.calls_daily "
+        "GROUP BY call_type ORDER BY n DESC",
+    ),
+    "daily count by battalion": (
+        f"SELECT call_date, battalion, COUNT(*) AS n FROM {RAW} "
+        "WHERE call_date >= DATE '2024-01-01' GROUP BY call_date, battalion",
+        "SELECT call_date, battalion, SUM(call_count) AS n FROM emergence.calls_daily "
+        "WHERE call_date >= DATE '2024-01-01' GROUP BY call_date, battalion",
+    ),
+    "count by priority and station_area": (
+        f"SELECT priority, station_area, COUNT(*) AS n FROM {RAW} GROUP BY priority, station_area",
+        "SELECT priority, station_area, SUM(call_count) AS n FROM emergence.calls_daily "
+        "GROUP BY priority, station_area",
+    ),
+    "daily p50 response by call_type, battalion": (
+        "SELECT call_date, call_type, battalion, percentile_cont(0.5) WITHIN GROUP "
+        "(ORDER BY extract(epoch FROM on_scene_dttm - received_dttm)) AS p50 "
+        f"FROM {RAW} WHERE on_scene_dttm >= received_dttm AND call_date >= DATE '2024-01-01' "
+        "GROUP BY call_date, call_type, battalion",
+        "SELECT call_date, call_type, battalion, p50_response_seconds AS p50 "
+        "FROM emergence.response_times_daily WHERE call_date >= DATE '2024-01-01'",
+    ),
+}
+
+
+def _time(sql: str, runs: int) -> list[float]:
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        database.execute_query_rows(sql, max_rows=100000, use_cache=False, guard=False)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    for name, (raw_sql, rollup_sql) in QUERIES.items():
+        raw = statistics.median(_time(raw_sql, args.runs))
+        rollup = statistics.median(_time(rollup_sql, args.runs))
+        print(
+            f"{name:<44} raw={raw * 1000:8.1f}ms rollup={rollup * 1000:8.1f}ms "
+            f"speedup={raw / rollup if rollup else float('inf'):6.1f}x"
+        )
+    database.close_pool()
+
+
+if __name__ == "__main__":
+    main()
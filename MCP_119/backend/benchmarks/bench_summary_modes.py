@@ -0,0 +1,85 @@
+"""Compare answer latency of the summary modes in ``utils.answer_with_summary``.
+
+Run from the backend directory::
+
+    python benchmarks/bench_summary_modes.py --model gpt-oss:20b --runs 5
+
+Without ``OLLAMA_URL`` (or with ``--fake-latency``) a local stand-in server
+answers every generation after a fixed delay, which isolates the number of
+LLM round trips each mode makes.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import llm_client  # noqa: E402
+import utils  # noqa: E402
+
+
+def _start_fake_ollama(latency: float) -> str:
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers["Content-Length"]))
+            time.sleep(latency)
+            body = json.dumps({"response": "摘要：共 3 筆資料。\n說明：查詢結果顯示三個分類。"})
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(body.encode())
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}/api/generate"
+
+
+async def _run(mode: str, model: str, runs: int, rows: list[dict]) -> list[float]:
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        await utils.answer_with_summary(
+            "各分類的案件數量？", rows, None, model=model, mode=mode
+        )
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", default="gpt-oss:20b")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--fake-latency", type=float, default=None)
+    args = parser.parse_args()
+
+    if args.fake_latency is not None or not llm_client.OLLAMA_URL:
+        llm_client.OLLAMA_URL = _start_fake_ollama(args.fake_latency or 0.5)
+    rows = [
+        {"call_type": t, "count": n}
+        for t, n in [("Medical Incident", 120), ("Alarms", 45), ("Structure Fire", 12)]
+    ]
+
+    async def run_all() -> None:
+        for mode in utils.SUMMARY_MODES:
+            timings = await _run(mode, args.model, args.runs, rows)
+            print(
+                f"{mode:<9} mean={statistics.mean(timings):.3f}s "
+                f"min={min(timings):.3f}s max={max(timings):.3f}s"
+            )
+        await llm_client.aclose()
+
+    asyncio.run(run_all())
+
+
+if __name__ == "__main__":
+    main()
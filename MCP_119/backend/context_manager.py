@@ -1,30 +1,84 @@
 from __future__ import annotations
 
 from dataclasses import dataclass, field
-from datetime import datetime
+from datetime import datetime, timedelta
 from textwrap import shorten
+from collections import OrderedDict
 from typing import List
+import asyncio
+import os
 import sqlite3
 import json
+import threading
 
+import prompt_templates
 
-@dataclass
+# Messages kept per user; older ones are compacted away (0 keeps everything)
+CONTEXT_MAX_MESSAGES = int(os.getenv("CONTEXT_MAX_MESSAGES", "200"))
+# Messages older than this many days are removed (0 disables age retention)
+CONTEXT_MAX_AGE_DAYS = float(os.getenv("CONTEXT_MAX_AGE_DAYS", "0"))
+# "tiered" keeps recent messages in memory in front of SQLite; "sqlite" does not
+CONTEXT_BACKEND = os.getenv("CONTEXT_BACKEND", "tiered")
+# Recent messages cached per user by the tiered backend
+CONTEXT_CACHE_MESSAGES = int(os.getenv("CONTEXT_CACHE_MESSAGES", "20"))
+# Approximate memory cap for all cached messages
+CONTEXT_CACHE_MAX_BYTES = int(os.getenv("CONTEXT_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+# Users whose parsed reference results are memoized
+REFERENCE_CACHE_USERS = int(os.getenv("REFERENCE_CACHE_USERS", "1024"))
+
+
+@dataclass(slots=True)
 class Message:
     role: str
     content: str
     timestamp: datetime = field(default_factory=datetime.utcnow)
 
+    def to_dict(self) -> dict:
+        return {"role": self.role, "content": self.content, "timestamp": self.timestamp}
+
 
 class ConversationContext:
-    """SQLite-backed conversation context manager."""
+    """SQLite-backed conversation context manager.
+
+    Each thread uses its own connection so reads run concurrently under WAL;
+    writes are serialized by a lock. The ``a``-prefixed coroutines run the
+    blocking calls in a worker thread for use from the event loop.
+    """
 
-    def __init__(self, db_path: str = "conversation.db") -> None:
-        self._conn = sqlite3.connect(db_path, check_same_thread=False)
-        self._conn.row_factory = sqlite3.Row
+    def __init__(
+        self,
+        db_path: str = "conversation.db",
+        *,
+        max_messages: int = CONTEXT_MAX_MESSAGES,
+        max_age_days: float = CONTEXT_MAX_AGE_DAYS,
+    ) -> None:
+        self.max_messages = max_messages
+        self.max_age_days = max_age_days
+        self._db_path = db_path
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        self._conns: list[sqlite3.Connection] = []
+        self._conns_lock = threading.Lock()
+        self._references: OrderedDict[str, list | dict] = OrderedDict()
+        self._references_lock = threading.Lock()
         self._create_table()
 
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        """Return the calling thread's connection, opening it on first use."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self._db_path, timeout=30, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._conns_lock:
+                self._conns.append(conn)
+        return conn
+
     def _create_table(self) -> None:
-        with self._conn:
+        with self._write_lock, self._conn:
             self._conn.execute(
                 """
                 CREATE TABLE IF NOT EXISTS messages (
@@ -36,18 +90,71 @@ class ConversationContext:
                 )
                 """
             )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_messages_user_id ON messages (user_id, id)"
+            )
 
     def record(self, user_id: str, query: str, response: str) -> None:
         """Store a user query and assistant response."""
-        with self._conn:
-            self._conn.execute(
-                "INSERT INTO messages (user_id, role, content, timestamp) VALUES (?, ?, ?, ?)",
-                (user_id, "user", query, datetime.utcnow().isoformat()),
+        now = datetime.utcnow()
+        messages = [Message("user", query, now), Message("assistant", response, now)]
+        conn = self._conn
+        with self._write_lock:
+            with conn:
+                conn.executemany(
+                    "INSERT INTO messages (user_id, role, content, timestamp) VALUES (?, ?, ?, ?)",
+                    [(user_id, m.role, m.content, now.isoformat()) for m in messages],
+                )
+                expired = self._compact(conn, user_id)
+            self._on_record(user_id, messages, expired)
+
+    def _on_record(self, user_id: str, messages: List[Message], expired: int) -> None:
+        """Hook called after a committed write while the write lock is held.
+
+        ``expired`` is the number of messages removed by age retention.
+        """
+
+    def compact(self, user_id: str) -> None:
+        """Apply the retention policy to a user's messages."""
+        conn = self._conn
+        with self._write_lock:
+            with conn:
+                expired = self._compact(conn, user_id)
+            self._on_compact(user_id, expired)
+
+    def _on_compact(self, user_id: str, expired: int) -> None:
+        """Hook called after :meth:`compact` while the write lock is held."""
+
+    def _compact(self, conn: sqlite3.Connection, user_id: str) -> int:
+        """Apply retention and return the number of messages removed by age."""
+        # The first assistant message is always kept because it provides the
+        # reference results returned by get_first_results
+        if self.max_messages <= 0 and self.max_age_days <= 0:
+            return 0
+        first = conn.execute(
+            "SELECT id FROM messages WHERE user_id=? AND role='assistant' ORDER BY id LIMIT 1",
+            (user_id,),
+        ).fetchone()
+        keep_id = first["id"] if first else -1
+        if self.max_messages > 0:
+            conn.execute(
+                """
+                DELETE FROM messages
+                WHERE user_id=? AND id != ? AND id <= (
+                    SELECT id FROM messages WHERE user_id=?
+                    ORDER BY id DESC LIMIT 1 OFFSET ?
+                )
+                """,
+                (user_id, keep_id, user_id, self.max_messages),
             )
-            self._conn.execute(
-                "INSERT INTO messages (user_id, role, content, timestamp) VALUES (?, ?, ?, ?)",
-                (user_id, "assistant", response, datetime.utcnow().isoformat()),
+        if self.max_age_days > 0:
+            cutoff = datetime.utcnow() - timedelta(days=self.max_age_days)
+            cur = conn.execute(
+                "DELETE FROM messages WHERE user_id=? AND id != ? AND timestamp < ?",
+                (user_id, keep_id, cutoff.isoformat()),
             )
+            return cur.rowcount
+        return 0
 
     def get_history(self, user_id: str) -> List[Message]:
         """Return the message history for a user."""
@@ -61,8 +168,41 @@ class ConversationContext:
             for row in rows
         ]
 
+    def get_recent(self, user_id: str, n: int) -> List[Message]:
+        """Return the ``n`` most recent messages for a user, oldest first."""
+        cur = self._conn.execute(
+            "SELECT role, content, timestamp FROM messages WHERE user_id=? ORDER BY id DESC LIMIT ?",
+            (user_id, n),
+        )
+        rows = cur.fetchall()
+        return [
+            Message(row["role"], row["content"], datetime.fromisoformat(row["timestamp"]))
+            for row in reversed(rows)
+        ]
+
     def get_first_results(self, user_id: str) -> list | None:
-        """Return the results from the first assistant message for a user."""
+        """Return the results from the first assistant message for a user.
+
+        The first assistant message never changes, so the parsed result is
+        memoized per user, truncated to the rows answer prompts use.
+        """
+        with self._references_lock:
+            reference = self._references.get(user_id)
+            if reference is not None:
+                self._references.move_to_end(user_id)
+                return reference
+        # Loading under the write lock keeps a concurrent reset from being
+        # overtaken by a stale memo
+        with self._write_lock:
+            reference = self._load_first_results(user_id)
+            if reference is not None:
+                with self._references_lock:
+                    self._references[user_id] = reference
+                    while len(self._references) > REFERENCE_CACHE_USERS:
+                        self._references.popitem(last=False)
+        return reference
+
+    def _load_first_results(self, user_id: str) -> list | None:
         cur = self._conn.execute(
             "SELECT content FROM messages WHERE user_id=? AND role='assistant' ORDER BY id LIMIT 1",
             (user_id,),
@@ -71,9 +211,16 @@ class ConversationContext:
         if not row:
             return None
         try:
-            return json.loads(row["content"])
+            data = json.loads(row["content"])
         except Exception:
             return None
+        limit = prompt_templates.ANSWER_RESULT_ROWS
+        # Results are stored in columnar form; expand them back into rows
+        if isinstance(data, dict) and "columns" in data and "rows" in data:
+            return [dict(zip(data["columns"], r)) for r in data["rows"][:limit]]
+        if isinstance(data, list):
+            return data[:limit]
+        return data
 
     def summarize(self, user_id: str, max_chars: int = 200) -> str:
         """Return a simple summary of the conversation history."""
@@ -83,11 +230,179 @@ class ConversationContext:
 
     def reset(self, user_id: str) -> None:
         """Clear all stored messages for the given user."""
-        with self._conn:
-            self._conn.execute(
-                "DELETE FROM messages WHERE user_id=?",
-                (user_id,),
-            )
+        conn = self._conn
+        with self._write_lock:
+            with conn:
+                conn.execute(
+                    "DELETE FROM messages WHERE user_id=?",
+                    (user_id,),
+                )
+            with self._references_lock:
+                self._references.pop(user_id, None)
+            self._on_reset(user_id)
+
+    def _on_reset(self, user_id: str) -> None:
+        """Hook called after a user's messages were deleted."""
 
     def close(self) -> None:
-        self._conn.close()
+        with self._conns_lock:
+            for conn in self._conns:
+                conn.close()
+            self._conns.clear()
+        self._local = threading.local()
+
+    async def arecord(self, user_id: str, query: str, response: str) -> None:
+        await asyncio.to_thread(self.record, user_id, query, response)
+
+    async def aget_history(self, user_id: str) -> List[Message]:
+        return await asyncio.to_thread(self.get_history, user_id)
+
+    async def aget_recent(self, user_id: str, n: int) -> List[Message]:
+        return await asyncio.to_thread(self.get_recent, user_id, n)
+
+    async def aget_first_results(self, user_id: str) -> list | None:
+        return await asyncio.to_thread(self.get_first_results, user_id)
+
+    async def asummarize(self, user_id: str, max_chars: int = 200) -> str:
+        return await asyncio.to_thread(self.summarize, user_id, max_chars)
+
+    async def areset(self, user_id: str) -> None:
+        await asyncio.to_thread(self.reset, user_id)
+
+
+class _CachedHistory:
+    __slots__ = ("messages", "complete", "size")
+
+    def __init__(self, messages: List[Message], complete: bool) -> None:
+        self.messages = messages
+        # True when ``messages`` is the user's entire stored history
+        self.complete = complete
+        self.size = sum(_message_size(m) for m in messages)
+
+
+def _message_size(message: Message) -> int:
+    # Rough per-object overhead plus the content itself
+    return 120 + len(message.content)
+
+
+class TieredConversationContext(ConversationContext):
+    """Conversation context with a per-user LRU cache of recent messages.
+
+    Writes go through to SQLite first; reads of recent messages for active
+    users are served from memory without re-parsing rows.
+    """
+
+    def __init__(
+        self,
+        db_path: str = "conversation.db",
+        *,
+        cache_messages: int = CONTEXT_CACHE_MESSAGES,
+        cache_max_bytes: int = CONTEXT_CACHE_MAX_BYTES,
+        **kwargs,
+    ) -> None:
+        self.cache_messages = cache_messages
+        self.cache_max_bytes = cache_max_bytes
+        self._cache: OrderedDict[str, _CachedHistory] = OrderedDict()
+        self._cache_size = 0
+        self._cache_lock = threading.Lock()
+        super().__init__(db_path, **kwargs)
+        # Trimming to max_messages must only remove messages the cache has
+        # already let go of, so it never holds more than SQLite keeps
+        if self.max_messages > 0:
+            self.cache_messages = min(self.cache_messages, self.max_messages)
+
+    def _cached(self, user_id: str) -> _CachedHistory | None:
+        with self._cache_lock:
+            entry = self._cache.get(user_id)
+            if entry is not None:
+                self._cache.move_to_end(user_id)
+            return entry
+
+    def _store(self, user_id: str, messages: List[Message], complete: bool) -> None:
+        if len(messages) > self.cache_messages:
+            messages = messages[-self.cache_messages:]
+            complete = False
+        entry = _CachedHistory(messages, complete)
+        with self._cache_lock:
+            old = self._cache.pop(user_id, None)
+            if old is not None:
+                self._cache_size -= old.size
+            self._cache[user_id] = entry
+            self._cache_size += entry.size
+            self._evict()
+
+    def _evict(self) -> None:
+        while self._cache_size > self.cache_max_bytes and self._cache:
+            _, entry = self._cache.popitem(last=False)
+            self._cache_size -= entry.size
+
+    def _drop(self, user_id: str) -> None:
+        with self._cache_lock:
+            entry = self._cache.pop(user_id, None)
+            if entry is not None:
+                self._cache_size -= entry.size
+
+    def get_recent(self, user_id: str, n: int) -> List[Message]:
+        entry = self._cached(user_id)
+        if entry is not None and (entry.complete or len(entry.messages) >= n):
+            return entry.messages[-n:] if n > 0 else []
+        limit = max(n, self.cache_messages)
+        # Holding the write lock keeps a concurrent record from being lost
+        # between loading the messages and caching them
+        with self._write_lock:
+            messages = super().get_recent(user_id, limit)
+            self._store(user_id, messages, len(messages) < limit)
+        return messages[-n:] if n > 0 else []
+
+    def get_history(self, user_id: str) -> List[Message]:
+        entry = self._cached(user_id)
+        if entry is not None and entry.complete:
+            return list(entry.messages)
+        with self._write_lock:
+            messages = super().get_history(user_id)
+            self._store(user_id, messages, True)
+        return messages
+
+    def _on_record(self, user_id: str, messages: List[Message], expired: int) -> None:
+        if expired:
+            # Age retention may have removed cached messages
+            self._drop(user_id)
+            return
+        with self._cache_lock:
+            entry = self._cache.get(user_id)
+            if entry is None:
+                return
+            entry.messages = entry.messages + messages
+            added = sum(_message_size(m) for m in messages)
+            entry.size += added
+            self._cache_size += added
+            excess = len(entry.messages) - self.cache_messages
+            if excess > 0:
+                removed = entry.messages[:excess]
+                entry.messages = entry.messages[excess:]
+                freed = sum(_message_size(m) for m in removed)
+                entry.size -= freed
+                self._cache_size -= freed
+                entry.complete = False
+            self._cache.move_to_end(user_id)
+            self._evict()
+
+    def _on_compact(self, user_id: str, expired: int) -> None:
+        if expired:
+            self._drop(user_id)
+
+    def _on_reset(self, user_id: str) -> None:
+        self._drop(user_id)
+
+    def cache_stats(self) -> dict:
+        with self._cache_lock:
+            return {"users": len(self._cache), "bytes": self._cache_size}
+
+
+def create_context(backend: str = CONTEXT_BACKEND, **kwargs) -> ConversationContext:
+    """Return the conversation context implementation named by ``backend``."""
+    if backend == "sqlite":
+        return ConversationContext(**kwargs)
+    if backend == "tiered":
+        return TieredConversationContext(**kwargs)
+    raise ValueError(f"Unknown context backend: {backend}")
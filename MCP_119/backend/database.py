@@ -1,40 +1,267 @@
+import asyncio
 import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass
+import sql_guard
+from result_cache import ResultCache, canonicalize_sql, estimate_size, is_cacheable
 try:
     import psycopg2
+    from psycopg2 import extensions as pg_extensions
     from psycopg2.extras import RealDictCursor
+    from psycopg2.pool import ThreadedConnectionPool
 except Exception:  # pragma: no cover - optional dependency may be missing
     psycopg2 = None
+    pg_extensions = None
     RealDictCursor = None
+    ThreadedConnectionPool = None
 
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+# Milliseconds; 0 disables the server-side statement timeout
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "30000"))
+# Run "SELECT 1" on checkout to detect connections dropped by the server
+DB_POOL_PING = os.getenv("DB_POOL_PING", "false").lower() in {"1", "true", "yes"}
 
-def _get_connection():
-    if psycopg2 is None:
-        raise ImportError("psycopg2 is required to use execute_query")
-    return psycopg2.connect(
+# Hard cap on rows returned by execute_query; extra rows are never fetched
+DB_MAX_ROWS = int(os.getenv("DB_MAX_ROWS", "5000"))
+# Rows transferred per round trip from the server-side cursor
+DB_FETCH_BATCH = int(os.getenv("DB_FETCH_BATCH", "500"))
+
+# Total size of cached query results; 0 disables the result cache
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Seconds between checks of the data version that invalidates cached results
+RESULT_CACHE_CHECK_INTERVAL = float(os.getenv("RESULT_CACHE_CHECK_INTERVAL", "30"))
+RESULT_CACHE_VERSION_SQL = os.getenv(
+    "RESULT_CACHE_VERSION_SQL",
+    "SELECT sum(generation) FROM emergence.sync_generation",
+)
+
+_pool = None
+_pool_lock = threading.Lock()
+# ThreadedConnectionPool raises when exhausted; this makes callers wait instead
+_pool_slots = threading.BoundedSemaphore(DB_POOL_MAX)
+
+
+def _connect_kwargs() -> dict:
+    kwargs = dict(
         host=os.getenv("DB_HOST", "localhost"),
         port=int(os.getenv("DB_PORT", "5432")),
         dbname=os.getenv("DB_NAME", "postgres"),
         user=os.getenv("DB_USER", "user"),
         password=os.getenv("DB_PASSWORD", "123456"),
     )
+    if DB_STATEMENT_TIMEOUT_MS > 0:
+        kwargs["options"] = f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"
+    return kwargs
 
 
-def execute_query(query: str) -> list[dict]:
-    """Execute an SQL query and return the results as a list of dicts."""
-    conn = _get_connection()
+def _get_pool():
+    global _pool
+    if psycopg2 is None:
+        raise ImportError("psycopg2 is required to use execute_query")
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadedConnectionPool(
+                    DB_POOL_MIN, DB_POOL_MAX, **_connect_kwargs()
+                )
+    return _pool
+
+
+def _is_healthy(conn) -> bool:
+    """Return True if a pooled connection can still be used."""
+    if conn.closed:
+        return False
+    status = conn.get_transaction_status()
+    if status == pg_extensions.TRANSACTION_STATUS_UNKNOWN:
+        return False
+    if status != pg_extensions.TRANSACTION_STATUS_IDLE:
+        conn.rollback()
+    if DB_POOL_PING:
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+        except psycopg2.Error:
+            return False
+    return True
+
+
+def _checkout(pool):
+    # Stale idle connections are discarded until a usable one turns up
+    for _ in range(DB_POOL_MAX):
+        conn = pool.getconn()
+        if _is_healthy(conn):
+            return conn
+        pool.putconn(conn, close=True)
+    return pool.getconn()
+
+
+@contextmanager
+def _get_connection():
+    """Borrow a healthy connection from the pool and return it afterwards."""
+    pool = _get_pool()
+    _pool_slots.acquire()
     try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute(query)
-            rows = cur.fetchall()
-            return [dict(row) for row in rows]
+        conn = _checkout(pool)
+        broken = False
+        try:
+            yield conn
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            if not broken and not conn.closed:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    broken = True
+            pool.putconn(conn, close=broken or bool(conn.closed))
     finally:
-        conn.close()
+        _pool_slots.release()
+
+
+def close_pool() -> None:
+    """Close every pooled connection."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+
+
+_result_cache = ResultCache(RESULT_CACHE_MAX_BYTES) if RESULT_CACHE_MAX_BYTES > 0 else None
+_version_checked_at = 0.0
+
+
+def _refresh_data_version() -> None:
+    """Re-read the data version at most every RESULT_CACHE_CHECK_INTERVAL seconds."""
+    global _version_checked_at
+    now = time.monotonic()
+    if now - _version_checked_at < RESULT_CACHE_CHECK_INTERVAL:
+        return
+    _version_checked_at = now
+    try:
+        with _get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(RESULT_CACHE_VERSION_SQL)
+                row = cur.fetchone()
+        version = row[0] if row else None
+    except Exception:
+        # Without a trustworthy version nothing cached may be reused
+        version = object()
+    _result_cache.set_version(version)
+
+
+def result_cache_stats() -> dict:
+    """Return statistics of the query result cache."""
+    if _result_cache is None:
+        return {"enabled": False}
+    return _result_cache.stats()
+
+
+@dataclass
+class QueryResult:
+    """Rows of a query as tuples plus a single column header."""
+
+    columns: list[str]
+    rows: list[tuple]
+    # True when the query produced more than the requested maximum rows
+    truncated: bool = False
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def to_dicts(self) -> list[dict]:
+        return [dict(zip(self.columns, row)) for row in self.rows]
+
+
+def _fetch(conn, query: str, max_rows: int, batch_size: int, guarded: bool = False) -> QueryResult:
+    if guarded:
+        sql_guard.protect(conn, query)
+    # SELECT statements go through a named (server-side) cursor so only the
+    # rows actually fetched ever leave the database
+    server_side = is_cacheable(query)
+    if server_side:
+        cur = conn.cursor(name=f"q_{uuid.uuid4().hex}")
+        cur.itersize = batch_size
+    else:
+        cur = conn.cursor()
+    with cur:
+        cur.execute(query)
+        if not server_side and cur.description is None:
+            return QueryResult([], [])
+        rows: list[tuple] = []
+        # Fetch one row past the cap to learn whether the result was cut off
+        while len(rows) <= max_rows:
+            batch = cur.fetchmany(min(batch_size, max_rows + 1 - len(rows)))
+            if not batch:
+                break
+            rows.extend(batch)
+        columns = [col.name for col in cur.description] if cur.description else []
+    truncated = len(rows) > max_rows
+    del rows[max_rows:]
+    return QueryResult(columns, rows, truncated)
+
+
+def execute_query_rows(
+    query: str,
+    *,
+    max_rows: int | None = None,
+    use_cache: bool = True,
+    guard: bool = True,
+) -> QueryResult:
+    """Execute an SQL query and return at most ``max_rows`` rows.
+
+    With ``guard`` the query must pass :mod:`sql_guard`: it runs read-only
+    with a LIMIT, a statement timeout and a planner cost budget. Read-only
+    queries are answered from the result cache while the table's data
+    version is unchanged.
+    """
+    max_rows = DB_MAX_ROWS if max_rows is None else max_rows
+    guard = guard and sql_guard.SQL_GUARD_ENABLED
+    if guard:
+        query = sql_guard.prepare(query, limit=max_rows + 1)
+    cache_key = None
+    if _result_cache is not None and use_cache and is_cacheable(query):
+        _refresh_data_version()
+        version = _result_cache.version
+        cache_key = f"{max_rows}:{canonicalize_sql(query)}"
+        cached = _result_cache.get(cache_key)
+        if cached is not None:
+            return cached
+    with _get_connection() as conn:
+        result = _fetch(conn, query, max_rows, DB_FETCH_BATCH, guarded=guard)
+    if cache_key is not None:
+        size = estimate_size(result.columns) + estimate_size(result.rows)
+        _result_cache.put(cache_key, result, version, size)
+    return result
+
+
+def is_query_error(exc: BaseException) -> bool:
+    """Return True if ``exc`` was caused by the statement rather than the database.
+
+    Syntax errors, unknown columns, type mismatches and guard rejections
+    qualify; connection failures and timeouts do not.
+    """
+    if isinstance(exc, sql_guard.SQLGuardError):
+        return True
+    return psycopg2 is not None and isinstance(
+        exc, (psycopg2.ProgrammingError, psycopg2.DataError)
+    )
+
+
+def execute_query(query: str, *, use_cache: bool = True, guard: bool = True) -> list[dict]:
+    """Execute an SQL query and return the results as a list of dicts."""
+    return execute_query_rows(query, use_cache=use_cache, guard=guard).to_dicts()
 
 
 def describe_schema() -> str:
     """Return a simple text description of tables and columns in the database."""
-    conn = _get_connection()
-    try:
+    with _get_connection() as conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
             cur.execute(
                 """
@@ -45,8 +272,6 @@ def describe_schema() -> str:
                 """
             )
             rows = cur.fetchall()
-    finally:
-        conn.close()
 
     tables: dict[str, list[str]] = {}
     for row in rows:
@@ -59,16 +284,37 @@ def describe_schema() -> str:
 
 def get_table_columns(table: str, *, schema: str | None = None) -> list[str]:
     """Return a list of column names for the specified table."""
-    conn = _get_connection()
-    try:
+    with _get_connection() as conn:
         with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            schema_clause = f"table_schema = '{schema}'" if schema else "table_schema = 'postgres'"
-            query = (
+            cur.execute(
                 "SELECT column_name FROM information_schema.columns "
-                f"WHERE {schema_clause} AND table_name = '{table}' ORDER BY ordinal_position"
+                "WHERE table_schema = %s AND table_name = %s ORDER BY ordinal_position",
+                (schema or "postgres", table),
             )
-            cur.execute(query)
             rows = cur.fetchall()
             return [row["column_name"] for row in rows]
-    finally:
-        conn.close()
+
+
+# Async variants run the blocking driver calls in a worker thread so the
+# event loop stays responsive while a query is in flight.
+
+async def execute_query_async(
+    query: str, *, use_cache: bool = True, guard: bool = True
+) -> list[dict]:
+    return await asyncio.to_thread(execute_query, query, use_cache=use_cache, guard=guard)
+
+
+async def execute_query_rows_async(
+    query: str, *, max_rows: int | None = None, use_cache: bool = True, guard: bool = True
+) -> QueryResult:
+    return await asyncio.to_thread(
+        execute_query_rows, query, max_rows=max_rows, use_cache=use_cache, guard=guard
+    )
+
+
+async def describe_schema_async() -> str:
+    return await asyncio.to_thread(describe_schema)
+
+
+async def get_table_columns_async(table: str, *, schema: str | None = None) -> list[str]:
+    return await asyncio.to_thread(get_table_columns, table, schema=schema)
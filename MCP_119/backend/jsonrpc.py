@@ -1,6 +1,17 @@
 """Utility functions for JSON-RPC 2.0 message creation."""
+import base64
+import datetime
+import decimal
+import json
 from typing import Any, Dict, Optional
-from uuid import uuid4
+from uuid import UUID, uuid4
+
+from fastapi.responses import Response
+
+try:
+    import orjson
+except Exception:  # pragma: no cover - optional dependency may be missing
+    orjson = None
 
 JSON_RPC_VERSION = "2.0"
 
@@ -27,3 +38,52 @@ def build_response(result: Any | None = None, id: Optional[str] | None = None, e
     else:
         response["result"] = result
     return response
+
+
+def _default(obj: Any) -> Any:
+    """Encode the non-JSON types returned by psycopg2."""
+    if isinstance(obj, (datetime.datetime, datetime.date, datetime.time)):
+        return obj.isoformat()
+    if isinstance(obj, datetime.timedelta):
+        # Same as FastAPI's jsonable_encoder
+        return obj.total_seconds()
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    if isinstance(obj, UUID):
+        return str(obj)
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    if isinstance(obj, (bytes, bytearray, memoryview)):
+        # bytea columns arrive as memoryview; binary data falls back to base64
+        data = bytes(obj)
+        try:
+            return data.decode()
+        except UnicodeDecodeError:
+            return base64.b64encode(data).decode("ascii")
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+_stdlib_encoder = json.JSONEncoder(
+    ensure_ascii=False, separators=(",", ":"), default=_default
+)
+
+
+def dumps(content: Any) -> bytes:
+    """Serialize ``content`` to UTF-8 JSON, using orjson when available."""
+    if orjson is not None:
+        return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return _stdlib_encoder.encode(content).encode("utf-8")
+
+
+class JSONRPCResponse(Response):
+    """Response that serializes directly, skipping FastAPI's jsonable_encoder."""
+
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def respond(result: Any | None = None, id: Optional[str] | None = None, error: Optional[Dict[str, Any]] | None = None) -> JSONRPCResponse:
+    """Return a JSON-RPC response object ready to be sent to the client."""
+    return JSONRPCResponse(build_response(result=result, id=id, error=error))
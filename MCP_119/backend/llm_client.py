@@ -0,0 +1,141 @@
+"""Shared asynchronous client for the Ollama generate API."""
+
+import asyncio
+import json
+import os
+from typing import AsyncIterator
+
+import httpx
+from dotenv import load_dotenv
+
+from logger import logger
+
+load_dotenv(dotenv_path=".env")
+
+OLLAMA_URL = os.getenv("OLLAMA_URL")
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "300"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "10"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_RETRY_BACKOFF = float(os.getenv("LLM_RETRY_BACKOFF", "0.5"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+# Maximum number of in-flight generations per model
+LLM_MODEL_CONCURRENCY = int(os.getenv("LLM_MODEL_CONCURRENCY", "4"))
+
+_client: httpx.AsyncClient | None = None
+_semaphores: dict[str, asyncio.Semaphore] = {}
+
+
+def _get_client() -> httpx.AsyncClient:
+    """Return the shared keep-alive HTTP client, creating it on first use."""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(LLM_TIMEOUT, connect=LLM_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_MAX_CONNECTIONS,
+            ),
+        )
+    return _client
+
+
+def _get_semaphore(model: str) -> asyncio.Semaphore:
+    """Return the semaphore limiting concurrent generations for ``model``."""
+    sem = _semaphores.get(model)
+    if sem is None:
+        sem = asyncio.Semaphore(LLM_MODEL_CONCURRENCY)
+        _semaphores[model] = sem
+    return sem
+
+
+def parse_response(text: str) -> dict:
+    """Decode an Ollama response body into a single object.
+
+    The response may contain multiple JSON objects without a surrounding
+    array. They are decoded sequentially and their ``response`` fields merged.
+    """
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        decoder = json.JSONDecoder()
+        remaining = text
+        chunks: list[str] = []
+        last_obj: dict | None = None
+        while remaining.strip():
+            try:
+                obj, idx = decoder.raw_decode(remaining.lstrip())
+            except json.JSONDecodeError:
+                break
+            chunks.append(str(obj.get("response", "")))
+            last_obj = obj
+            remaining = remaining.lstrip()[idx:]
+
+        if last_obj is None:
+            raise
+        last_obj["response"] = "".join(chunks)
+        return last_obj
+
+
+def _is_retryable(exc: Exception) -> bool:
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code >= 500
+    return isinstance(exc, httpx.TransportError)
+
+
+async def generate(model: str, prompt: str) -> str:
+    """Return the text generated by ``model`` for ``prompt``.
+
+    Transport errors and 5xx responses are retried with exponential backoff.
+    """
+    if not OLLAMA_URL:
+        raise RuntimeError("OLLAMA_URL is not configured")
+    payload = {"model": model, "prompt": prompt, "stream": False}
+    client = _get_client()
+    attempt = 0
+    async with _get_semaphore(model):
+        while True:
+            try:
+                resp = await client.post(OLLAMA_URL, json=payload)
+                resp.raise_for_status()
+                break
+            except Exception as exc:
+                if attempt >= LLM_MAX_RETRIES or not _is_retryable(exc):
+                    raise
+                delay = LLM_RETRY_BACKOFF * (2 ** attempt)
+                attempt += 1
+                logger.warning(
+                    f"LLM request failed ({exc!r}), retry {attempt}/{LLM_MAX_RETRIES} in {delay:.1f}s"
+                )
+                await asyncio.sleep(delay)
+    data = parse_response(resp.text)
+    return str(data.get("response", ""))
+
+
+async def generate_stream(model: str, prompt: str) -> AsyncIterator[str]:
+    """Yield text fragments from ``model`` as Ollama streams them."""
+    if not OLLAMA_URL:
+        raise RuntimeError("OLLAMA_URL is not configured")
+    payload = {"model": model, "prompt": prompt, "stream": True}
+    client = _get_client()
+    async with _get_semaphore(model):
+        async with client.stream("POST", OLLAMA_URL, json=payload) as resp:
+            resp.raise_for_status()
+            async for line in resp.aiter_lines():
+                if not line.strip():
+                    continue
+                obj = json.loads(line)
+                if "error" in obj:
+                    raise RuntimeError(obj["error"])
+                token = obj.get("response", "")
+                if token:
+                    yield token
+                if obj.get("done"):
+                    break
+
+
+async def aclose() -> None:
+    """Close the shared HTTP client."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
@@ -1,20 +1,46 @@
-from fastapi import FastAPI, WebSocket
-from pydantic import BaseModel
-from utils import summarize_results
-import json
+import asyncio
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from typing import Literal
+
+from pydantic import BaseModel, ValidationError
+from utils import (
+    answer_with_summary,
+    encode_results,
+    serialize_results,
+    summarize_results,
+    summary_mode_for,
+)
 from fastapi.middleware.cors import CORSMiddleware
 import jsonrpc
 from model_router import ModelRouter
 import prompt_templates
-from context_manager import ConversationContext
+from context_manager import create_context
 import sql_generator
 import answer_generator
 import database
+import llm_client
+import schema_cache
+import sql_cache
 from logger import logger
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    await llm_client.aclose()
+    database.close_pool()
+    context_manager.close()
+    sql_cache.close_default()
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=jsonrpc.JSONRPCResponse)
+# Number of result rows sent per "rows" event when streaming
+STREAM_ROW_CHUNK = 200
 router = ModelRouter()
-context_manager = ConversationContext()
+context_manager = create_context()
 
 app.add_middleware(
     CORSMiddleware,
@@ -60,11 +86,17 @@ class SQLRequest(BaseModel):
     user_id: str | None = None
 
 
+SummaryMode = Literal["separate", "combined", "derived"]
+ResultFormat = Literal["rows", "columnar"]
+
+
 class SQLExecuteRequest(BaseModel):
     query: str
     user_id: str | None = None
     model: str | None = None
     question: str | None = None
+    summary_mode: SummaryMode | None = None
+    result_format: ResultFormat = "rows"
 
 
 class AskRequest(BaseModel):
@@ -72,6 +104,8 @@ class AskRequest(BaseModel):
     model: str | None = None
     user_id: str | None = None
     use_history: bool = True
+    summary_mode: SummaryMode | None = None
+    result_format: ResultFormat = "rows"
 
 
 class ChartRequest(BaseModel):
@@ -79,25 +113,40 @@ class ChartRequest(BaseModel):
     model: str | None = None
     user_id: str | None = None
     use_history: bool = True
+    summary_mode: SummaryMode | None = None
+    result_format: ResultFormat = "rows"
+    # base_sql is only echoed back; skipping it saves one LLM generation
+    include_base_sql: bool = True
 
 
 @app.get("/")
 async def root():
     """Return a simple greeting for the API root."""
-    return jsonrpc.build_response(result={"message": "Welcome"})
+    return jsonrpc.respond(result={"message": "Welcome"})
 
 
 @app.get("/hello")
 async def read_root():
-    return jsonrpc.build_response(result={"message": "Hello from FastAPI"})
+    return jsonrpc.respond(result={"message": "Hello from FastAPI"})
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
+    """Stream /ask stage events for each JSON question received."""
     await websocket.accept()
     try:
         while True:
             data = await websocket.receive_text()
-            await websocket.send_text(f"Message text was: {data}")
+            try:
+                request = AskRequest.model_validate_json(data)
+            except ValidationError as exc:
+                await websocket.send_text(_encode_event(
+                    {"type": "error", "message": str(exc)}
+                ))
+                continue
+            async for event in _ask_events(request):
+                await websocket.send_text(_encode_event(event))
+    except WebSocketDisconnect:
+        pass
     except Exception:
         await websocket.close()
 
@@ -118,7 +167,7 @@ async def handle_query(request: QueryRequest):
 async def select_model(request: ModelRequest):
     """Select a model based on user or task information."""
     model_name = router.route(task_type=request.task_type, user_id=request.user_id)
-    return jsonrpc.build_response(result={"model": model_name})
+    return jsonrpc.respond(result={"model": model_name})
 
 
 @app.get("/models")
@@ -126,7 +175,7 @@ async def select_model(request: ModelRequest):
 async def list_models():
     """Return the list of available model names."""
     models = router.list_models()
-    return jsonrpc.build_response(result={"models": models})
+    return jsonrpc.respond(result={"models": models})
 
 
 @app.post("/prompt")
@@ -135,47 +184,87 @@ async def build_prompt(request: PromptRequest):
     """Return a prompt with the user's query filled in."""
     template = prompt_templates.load_template(request.model, request.task)
     prompt = prompt_templates.fill_template(template, request.query)
-    return jsonrpc.build_response(result={"prompt": prompt})
+    return jsonrpc.respond(result={"prompt": prompt})
 
 
 @app.post("/context/record")
 @app.post("/api/context/record")
 async def record_interaction(request: RecordRequest):
     """Record a user query and response in the conversation context."""
-    context_manager.record(request.user_id, request.query, request.response)
-    return jsonrpc.build_response(result={"status": "ok"})
+    await context_manager.arecord(request.user_id, request.query, request.response)
+    return jsonrpc.respond(result={"status": "ok"})
 
 
 @app.post("/context/retrieve")
 @app.post("/api/context/retrieve")
 async def retrieve_history(request: RetrieveRequest):
     """Retrieve the conversation history for a user."""
-    messages = context_manager.get_history(request.user_id)
-    return jsonrpc.build_response(result={"history": [m.__dict__ for m in messages]})
+    messages = await context_manager.aget_history(request.user_id)
+    return jsonrpc.respond(result={"history": [m.to_dict() for m in messages]})
 
 
 @app.post("/context/reset")
 @app.post("/api/context/reset")
 async def reset_history(request: ResetRequest):
     """Delete all conversation history for a user."""
-    context_manager.reset(request.user_id)
-    return jsonrpc.build_response(result={"status": "ok"})
+    await context_manager.areset(request.user_id)
+    return jsonrpc.respond(result={"status": "ok"})
 
 
 @app.get("/context/history")
 @app.get("/api/context/history")
 async def get_history(user_id: str):
     """Return the message history for a user."""
-    messages = context_manager.get_history(user_id)
-    return jsonrpc.build_response(result={"history": [m.__dict__ for m in messages]})
+    messages = await context_manager.aget_history(user_id)
+    return jsonrpc.respond(result={"history": [m.to_dict() for m in messages]})
 
 
 @app.get("/context/summary")
 @app.get("/api/context/summary")
 async def get_summary(user_id: str):
     """Return a summary of the conversation history for a user."""
-    summary = context_manager.summarize(user_id)
-    return jsonrpc.build_response(result={"summary": summary})
+    summary = await context_manager.asummarize(user_id)
+    return jsonrpc.respond(result={"summary": summary})
+
+
+@app.post("/schema/refresh")
+@app.post("/api/schema/refresh")
+async def refresh_schema():
+    """Invalidate the cached schema description and reload it."""
+    schema_cache.invalidate()
+    try:
+        await schema_cache.get_prompt_context()
+    except Exception as exc:  # pragma: no cover - depends on environment
+        return jsonrpc.respond(
+            error={"code": -32000, "message": str(exc)}
+        )
+    return jsonrpc.respond(result={"status": "ok", "version": schema_cache.version()})
+
+
+@app.get("/sql/cache/stats")
+@app.get("/api/sql/cache/stats")
+async def sql_cache_stats():
+    """Return hit/miss statistics of the question to SQL cache."""
+    cache = sql_cache.get_default()
+    stats = cache.stats() if cache is not None else {"enabled": False}
+    return jsonrpc.respond(result=stats)
+
+
+@app.post("/sql/cache/clear")
+@app.post("/api/sql/cache/clear")
+async def clear_sql_cache():
+    """Remove every entry from the question to SQL cache."""
+    cache = sql_cache.get_default()
+    if cache is not None:
+        await asyncio.to_thread(cache.clear)
+    return jsonrpc.respond(result={"status": "ok"})
+
+
+@app.get("/results/cache/stats")
+@app.get("/api/results/cache/stats")
+async def result_cache_stats():
+    """Return statistics of the query result cache."""
+    return jsonrpc.respond(result=database.result_cache_stats())
 
 
 @app.post("/sql")
@@ -184,22 +273,24 @@ async def generate_sql(request: SQLRequest):
     """Generate an SQL query using an LLM."""
     try:
         history = (
-            context_manager.get_history(request.user_id)
+            await context_manager.aget_recent(
+                request.user_id, prompt_templates.HISTORY_MAX_TURNS * 2
+            )
             if request.user_id
             else []
         )
-        sql = sql_generator.generate_sql(
+        sql = await sql_generator.generate_sql(
             request.question, model=request.model, history=history
         )
     except ValueError as exc:
-        return jsonrpc.build_response(
+        return jsonrpc.respond(
             error={"code": -32000, "message": str(exc)}
         )
     except Exception as exc:  # pragma: no cover - depends on environment
-        return jsonrpc.build_response(
+        return jsonrpc.respond(
             error={"code": -32000, "message": str(exc)}
         )
-    return jsonrpc.build_response(result={"sql": sql_generator._clean_sql(sql)})
+    return jsonrpc.respond(result={"sql": sql_generator._clean_sql(sql)})
 
 
 @app.post("/sql/execute")
@@ -207,39 +298,38 @@ async def generate_sql(request: SQLRequest):
 async def execute_sql(request: SQLExecuteRequest):
     """Execute a SQL query, store the result, and return a JSON-RPC response."""
     try:
-        results = database.execute_query(request.query)
+        query_result = await database.execute_query_rows_async(request.query)
+        results = query_result.to_dicts()
     except Exception as exc:  # pragma: no cover - depends on environment
-        return jsonrpc.build_response(
+        return jsonrpc.respond(
             error={"code": -32000, "message": str(exc)}
         )
-    if request.user_id:
-        context_manager.record(request.user_id, request.query, json.dumps(results))
+    # None means this is the first stored result, so the answer uses ``results``
     reference = (
-        context_manager.get_first_results(request.user_id)
+        await context_manager.aget_first_results(request.user_id)
         if request.user_id
         else None
     )
-    if reference is None:
-        reference = results
-    summary = summarize_results(results)
+    if request.user_id:
+        await context_manager.arecord(request.user_id, request.query, serialize_results(query_result))
     # Always try to provide a natural language explanation of the results
     prompt_question = (
         request.question or "Summarize these query results in a friendly way."
     )
-    try:
-        answer = answer_generator.generate_answer(
-            prompt_question,
-            reference,
-            model=request.model or "llama3.2:3b",
-        )
-    except Exception:  # pragma: no cover - depends on environment
-        answer = ""
-    return jsonrpc.build_response(result={
-        "results": results,
+    summary, answer = await answer_with_summary(
+        prompt_question,
+        results,
+        reference,
+        model=request.model or "llama3.2:3b",
+        mode=request.summary_mode or summary_mode_for("sql_execute"),
+    )
+    return jsonrpc.respond(result={
+        "results": encode_results(query_result, request.result_format),
         "model": request.model,
         "sql": request.query,
         "summary": summary,
         "answer": answer,
+        "truncated": query_result.truncated,
     })
 
 
@@ -250,125 +340,253 @@ async def ask(request: AskRequest):
     """Generate SQL from a question, execute it, and return the results."""
     try:
         history = (
-            context_manager.get_history(request.user_id)
+            await context_manager.aget_recent(
+                request.user_id, prompt_templates.HISTORY_MAX_TURNS * 2
+            )
             if request.user_id
             else []
         )
-        sql = sql_generator.generate_sql(
+        sql = await sql_generator.generate_sql(
             request.question, model=request.model, history=history
         )
         logger.info(f"ASK SQL generated: {sql}")
     except ValueError as exc:
         logger.error(f"ASK SQL ValueError: {exc}")
-        return jsonrpc.build_response(
+        return jsonrpc.respond(
             error={"code": -32000, "message": str(exc)}
         )
     except Exception as exc:  # pragma: no cover - depends on environment
         logger.exception(f"ASK SQL Exception: {exc}")
-        return jsonrpc.build_response(
+        return jsonrpc.respond(
             error={"code": -32000, "message": str(exc)}
         )
 
     try:
-        results = database.execute_query(sql)
+        sql, query_result = await sql_generator.execute_with_repair(
+            request.question, sql, model=request.model, history=history
+        )
+        results = query_result.to_dicts()
         logger.info(f"ASK SQL executed, results_len={len(results)}")
     except Exception as exc:  # pragma: no cover - depends on environment
         logger.exception(f"ASK DB Exception: {exc}")
-        return jsonrpc.build_response(
+        return jsonrpc.respond(
             error={"code": -32000, "message": str(exc)}
         )
 
-    if request.user_id:
-        context_manager.record(request.user_id, sql, json.dumps(results))
+    # None means this is the first stored result, so the answer uses ``results``
     reference = (
-        context_manager.get_first_results(request.user_id)
+        await context_manager.aget_first_results(request.user_id)
         if request.user_id
         else None
     )
-    if reference is None:
-        reference = results
-
-    summary = summarize_results(results)
-    answer = ""
-    try:
-        answer = answer_generator.generate_answer(
-            request.question,
-            reference,
-            model=request.model or "llama3.2:3b",
-        )
-        logger.info(f"ASK answer generated, answer_len={len(answer)}")
-    except Exception as exc:  # pragma: no cover - depends on environment
-        logger.exception(f"ASK answer Exception: {exc}")
-        answer = ""
+    if request.user_id:
+        await context_manager.arecord(request.user_id, sql, serialize_results(query_result))
+
+    summary, answer = await answer_with_summary(
+        request.question,
+        results,
+        reference,
+        model=request.model or "llama3.2:3b",
+        mode=request.summary_mode or summary_mode_for("ask"),
+    )
+    logger.info(f"ASK answer generated, answer_len={len(answer)}")
 
     logger.info(f"ASK completed. SQL: {sql}, results_len={len(results)}, answer_len={len(answer)}")
-    return jsonrpc.build_response(result={
-        "results": results,
+    return jsonrpc.respond(result={
+        "results": encode_results(query_result, request.result_format),
         "model": request.model,
         "sql": sql_generator._clean_sql(sql),
         "summary": summary,
         "answer": answer,
+        "truncated": query_result.truncated,
     })
 
 
+def _encode_event(event: dict) -> str:
+    return jsonrpc.dumps(event).decode("utf-8")
+
+
+async def _ask_events(request: AskRequest):
+    """Run the /ask pipeline and yield an event as each stage completes.
+
+    Events are ``sql``, ``rows`` (in chunks), ``token`` (answer text as it is
+    generated) and finally ``done``; failures yield a single ``error`` event.
+    A second ``sql`` event marked ``repaired`` follows when the model had to
+    fix a query that failed.
+    """
+    try:
+        history = (
+            await context_manager.aget_recent(
+                request.user_id, prompt_templates.HISTORY_MAX_TURNS * 2
+            )
+            if request.user_id
+            else []
+        )
+        sql = await sql_generator.generate_sql(
+            request.question, model=request.model, history=history
+        )
+    except Exception as exc:
+        logger.exception(f"ASK stream SQL Exception: {exc}")
+        yield {"type": "error", "stage": "sql", "message": str(exc)}
+        return
+    yield {"type": "sql", "sql": sql_generator._clean_sql(sql)}
+
+    try:
+        generated_sql = sql
+        sql, query_result = await sql_generator.execute_with_repair(
+            request.question, sql, model=request.model, history=history
+        )
+        results = query_result.to_dicts()
+    except Exception as exc:  # pragma: no cover - depends on environment
+        logger.exception(f"ASK stream DB Exception: {exc}")
+        yield {"type": "error", "stage": "query", "message": str(exc)}
+        return
+    if sql != generated_sql:
+        yield {"type": "sql", "sql": sql_generator._clean_sql(sql), "repaired": True}
+    for start in range(0, len(results), STREAM_ROW_CHUNK):
+        event = {"type": "rows", "offset": start}
+        if request.result_format == "columnar":
+            event["columns"] = query_result.columns
+            event["rows"] = query_result.rows[start:start + STREAM_ROW_CHUNK]
+        else:
+            event["rows"] = results[start:start + STREAM_ROW_CHUNK]
+        yield event
+
+    # None means this is the first stored result, so the answer uses ``results``
+    reference = (
+        await context_manager.aget_first_results(request.user_id)
+        if request.user_id
+        else None
+    )
+    if request.user_id:
+        await context_manager.arecord(request.user_id, sql, serialize_results(query_result))
+
+    # A combined generation cannot be streamed token by token. The summary is
+    # derived from the answer unless the answer describes other rows; then,
+    # as in the "separate" mode, it is generated alongside the stream
+    summary_task = None
+    if reference is not None or (request.summary_mode or summary_mode_for("ask")) == "separate":
+        summary_task = asyncio.create_task(summarize_results(results))
+    tokens: list[str] = []
+    try:
+        async for token in answer_generator.generate_answer_stream(
+            request.question,
+            reference if reference is not None else results,
+            model=request.model or "llama3.2:3b",
+        ):
+            tokens.append(token)
+            yield {"type": "token", "text": token}
+    except Exception as exc:  # pragma: no cover - depends on environment
+        logger.exception(f"ASK stream answer Exception: {exc}")
+    except (GeneratorExit, asyncio.CancelledError):
+        # The client disconnected while tokens were streamed
+        if summary_task is not None:
+            summary_task.cancel()
+        raise
+    answer = "".join(tokens).strip()
+    if summary_task is not None:
+        summary = await summary_task
+    else:
+        summary = answer_generator.derive_summary(answer) if results else ""
+    yield {
+        "type": "done",
+        "results_len": len(results),
+        "truncated": query_result.truncated,
+        "summary": summary,
+        "answer": answer,
+    }
+
+
+@app.post("/ask/stream")
+@app.post("/api/ask/stream")
+async def ask_stream(request: AskRequest):
+    """Server-sent events alternative to the /ws streaming protocol."""
+    async def event_source():
+        async for event in _ask_events(request):
+            yield f"event: {event['type']}\ndata: {_encode_event(event)}\n\n"
+
+    return StreamingResponse(
+        event_source(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.post("/chart")
 @app.post("/api/chart")
 async def chart(request: ChartRequest):
     """Generate comparative chart data using two LLM SQL passes."""
     try:
         history = (
-            context_manager.get_history(request.user_id)
+            await context_manager.aget_recent(
+                request.user_id, prompt_templates.HISTORY_MAX_TURNS * 2
+            )
             if request.user_id
             else []
         )
-        base_sql = sql_generator.generate_sql(
-            request.question, model=request.model, history=history
-        )
-        chart_sql = sql_generator.generate_chart_sql(
-            request.question, model=request.model, history=history
-        )
+        # The two generations are independent, so run them concurrently
+        tasks = [
+            asyncio.create_task(sql_generator.generate_chart_sql(
+                request.question, model=request.model, history=history
+            ))
+        ]
+        if request.include_base_sql:
+            tasks.append(asyncio.create_task(sql_generator.generate_sql(
+                request.question, model=request.model, history=history
+            )))
+        try:
+            generated = await asyncio.gather(*tasks)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            raise
+        chart_sql = generated[0]
+        base_sql = generated[1] if request.include_base_sql else None
     except ValueError as exc:
-        return jsonrpc.build_response(
+        return jsonrpc.respond(
             error={"code": -32000, "message": str(exc)}
         )
     except Exception as exc:  # pragma: no cover - depends on environment
-        return jsonrpc.build_response(
+        return jsonrpc.respond(
             error={"code": -32000, "message": str(exc)}
         )
 
     try:
-        results = database.execute_query(chart_sql)
+        chart_sql, query_result = await sql_generator.execute_with_repair(
+            request.question, chart_sql, task="chart", model=request.model, history=history
+        )
+        results = query_result.to_dicts()
     except Exception as exc:  # pragma: no cover - depends on environment
-        return jsonrpc.build_response(
+        return jsonrpc.respond(
             error={"code": -32000, "message": str(exc)}
         )
 
-    if request.user_id:
-        context_manager.record(request.user_id, chart_sql, json.dumps(results))
+    # Look up the reference before recording: None means these results are
+    # the first stored ones and the answer is grounded on them
     reference = (
-        context_manager.get_first_results(request.user_id)
+        await context_manager.aget_first_results(request.user_id)
         if request.user_id
         else None
     )
-    if reference is None:
-        reference = results
 
-    summary = summarize_results(results)
-    answer = ""
-    try:
-        answer = answer_generator.generate_answer(
-            request.question,
-            reference,
-            model=request.model or "llama3.2:3b",
-        )
-    except Exception:  # pragma: no cover - depends on environment
-        answer = ""
+    answer_task = asyncio.create_task(answer_with_summary(
+        request.question,
+        results,
+        reference,
+        model=request.model or "llama3.2:3b",
+        mode=request.summary_mode or summary_mode_for("chart"),
+    ))
+    # Serialize and store the results while the answer is being generated
+    if request.user_id:
+        await context_manager.arecord(request.user_id, chart_sql, serialize_results(query_result))
+    summary, answer = await answer_task
 
-    return jsonrpc.build_response(result={
-        "results": results,
+    return jsonrpc.respond(result={
+        "results": encode_results(query_result, request.result_format),
         "model": request.model,
         "sql": sql_generator._clean_sql(chart_sql),
-        "base_sql": sql_generator._clean_sql(base_sql),
+        "base_sql": sql_generator._clean_sql(base_sql) if base_sql else None,
         "summary": summary,
         "answer": answer,
+        "truncated": query_result.truncated,
     })
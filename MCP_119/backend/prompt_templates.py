@@ -1,7 +1,20 @@
 """Utility functions to manage prompt templates."""
 
+import json
+import os
 from typing import Dict
 
+from logger import logger
+
+# Conversation turns (user + assistant message pairs) included in prompts
+HISTORY_MAX_TURNS = int(os.getenv("PROMPT_HISTORY_MAX_TURNS", "5"))
+# Approximate token budget for the history section of a prompt
+HISTORY_TOKEN_BUDGET = int(os.getenv("PROMPT_HISTORY_TOKEN_BUDGET", "1500"))
+# Characters of result data kept in the digest of an assistant message
+RESULT_DIGEST_CHARS = 300
+# Result rows included in answer prompts
+ANSWER_RESULT_ROWS = 20
+
 SQL_TEMPLATE = (
     "請根據下列資訊，僅產生最準確且完整的 SQL 查詢語句：\n"
     "1. 目標資料表：postgres.emergence.emergency_calls\n"
@@ -11,6 +24,8 @@ SQL_TEMPLATE = (
     "5. 使用者問題：{query}\n"
     "請注意：\n"
     "- 回答只能且必須是 SQL，不能包含任何解釋或其他內容。\n"
+    "- 若參考資料中的彙總表已涵蓋所需的欄位與統計，請改查詢彙總表。\n"
+    "- 計算派遣、交通或反應時間時，請使用參考資料中預先計算的時間欄位，不要以 EXTRACT(EPOCH FROM ...) 自行計算。\n"
     "- 查詢結果僅需列出前100筆資料。"
 )
 
@@ -26,6 +41,8 @@ CHART_TEMPLATE = (
     "- 查詢目的是讓使用者能和同一欄位下不同類型、分類、值的資料進行比較，產生對比圖表。\n"
     "- 請根據問題語意，適當選擇分組欄位與聚合方式（如 group by、count、sum、avg 等），y 軸應為資料量、次數或統計結果。\n"
     "- 若適用，可同時查詢多個類型或分類的資料。\n"
+    "- 若參考資料中的彙總表已涵蓋所需的分組欄位與統計，請改查詢彙總表以減少掃描量。\n"
+    "- 計算派遣、交通或反應時間時，請使用參考資料中預先計算的時間欄位，不要以 EXTRACT(EPOCH FROM ...) 自行計算。\n"
     "- 查詢結果僅需列出前100筆資料。\n"
     "- 回答只能且必須是 SQL，不能包含任何解釋或其他內容。"
 )
@@ -37,16 +54,49 @@ NLP_TEMPLATE = (
     "回應需結合提問與查詢資料的意義，並以易懂、友善的方式摘要重點，不需重複列出原始資料。"
 )
 
+# Produces the one-sentence summary and the detailed answer in one generation
+NLP_COMBINED_TEMPLATE = (
+    "請根據使用者的提問：{query}，以及下列 SQL 查詢結果，以繁體中文回覆：\n{results}\n"
+    "{reference}"
+    "請嚴格依照以下格式輸出兩段內容：\n"
+    "摘要：<以一句話總結上列查詢結果>\n"
+    "說明：<結合提問與查詢資料的意義，以易懂、友善的方式摘要重點，不需重複列出原始資料>"
+)
+
+# Inserted into NLP_COMBINED_TEMPLATE when the answer is grounded on other rows
+NLP_COMBINED_REFERENCE = "說明部分請以下列參考資料為依據：\n{rows}\n"
+
+# Characters of a database error message included in a repair prompt
+REPAIR_ERROR_CHARS = 500
+
+# Asks the model to fix SQL that failed, without repeating the history
+REPAIR_TEMPLATE = (
+    "下列 SQL 執行失敗，請根據錯誤訊息修正，僅輸出修正後的 SQL：\n"
+    "1. 目標資料表：postgres.emergence.emergency_calls\n"
+    "2. 可使用的欄位：{columns}\n"
+    "3. 參考資料：{reference_info}\n"
+    "4. 使用者問題：{query}\n"
+    "5. 失敗的 SQL：\n{sql}\n"
+    "6. 錯誤訊息：{error}\n"
+    "請注意：\n"
+    "- 保持原本的查詢意圖，只修正造成錯誤的部分。\n"
+    "- 回答只能且必須是 SQL，不能包含任何解釋或其他內容。"
+)
+
 PROMPT_TEMPLATES: Dict[str, Dict[str, str]] = {
     "gpt-oss:20b": {
         "sql": SQL_TEMPLATE,
         "chart": CHART_TEMPLATE,
         "nlp": NLP_TEMPLATE,
+        "nlp_combined": NLP_COMBINED_TEMPLATE,
+        "repair": REPAIR_TEMPLATE,
     },
     "qwen2.5-coder:7b": {
         "sql": SQL_TEMPLATE,
         "chart": CHART_TEMPLATE,
         "nlp": NLP_TEMPLATE,
+        "nlp_combined": NLP_COMBINED_TEMPLATE,
+        "repair": REPAIR_TEMPLATE,
     },
 }
 
@@ -60,9 +110,9 @@ def fill_template(template: str, query: str, **extra: str) -> str:
     """Insert the user's query and any extra data into the template. 若 results 為 list 且過大，僅取前 20 筆。"""
     # 處理 results 欄位，避免資料過大
     results = extra.get('results', None)
-    if isinstance(results, list) and len(results) > 20:
+    if isinstance(results, list) and len(results) > ANSWER_RESULT_ROWS:
         import json
-        extra['results'] = json.dumps(results[:20], ensure_ascii=False)
+        extra['results'] = json.dumps(results[:ANSWER_RESULT_ROWS], ensure_ascii=False)
     elif isinstance(results, list):
         import json
         extra['results'] = json.dumps(results, ensure_ascii=False)
@@ -70,6 +120,56 @@ def fill_template(template: str, query: str, **extra: str) -> str:
 
 
 
+def estimate_tokens(text: str) -> int:
+    """Return a rough token count (about 4 UTF-8 bytes per token)."""
+    return (len(text.encode("utf-8")) + 3) // 4
+
+
+def digest_content(content: str) -> str:
+    """Return a short digest of a stored message.
+
+    Assistant messages hold whole result sets; only the row count, the column
+    names and the first rows are kept.
+    """
+    try:
+        data = json.loads(content)
+    except (TypeError, ValueError):
+        return content[:RESULT_DIGEST_CHARS * 2]
+    if isinstance(data, dict) and "columns" in data and "rows" in data:
+        columns, rows = data["columns"], data["rows"]
+    elif isinstance(data, list) and data and isinstance(data[0], dict):
+        columns = list(data[0])
+        rows = [list(r.values()) for r in data]
+    else:
+        return content[:RESULT_DIGEST_CHARS * 2]
+    sample = json.dumps(rows[:3], ensure_ascii=False, default=str)[:RESULT_DIGEST_CHARS]
+    return f"{len(rows)} rows; columns: {', '.join(columns)}; first rows: {sample}"
+
+
+def compact_history(
+    history: list,
+    *,
+    max_turns: int = HISTORY_MAX_TURNS,
+    token_budget: int = HISTORY_TOKEN_BUDGET,
+) -> tuple[str, int]:
+    """Return the newest history that fits the budget and the messages kept.
+
+    Messages are taken from the end of ``history`` until ``max_turns`` turns
+    or ``token_budget`` tokens are used, and rendered oldest first.
+    """
+    lines: list[str] = []
+    used = 0
+    for message in reversed(history[-max_turns * 2:] if max_turns > 0 else []):
+        line = f"{message.role}: {digest_content(message.content)}"
+        cost = estimate_tokens(line)
+        if used + cost > token_budget:
+            break
+        lines.append(line)
+        used += cost
+    lines.reverse()
+    return "\n".join(lines), len(lines)
+
+
 def build_prompt_with_history(
     model: str,
     task: str,
@@ -80,9 +180,7 @@ def build_prompt_with_history(
 ) -> str:
     """Return a prompt that includes conversation history and optional data."""
     template = load_template(model, task)
-    history_text = (
-        "\n".join(f"{m.role}: {m.content}" for m in history) if history else ""
-    )
+    history_text, kept = compact_history(history)
     base_prompt = fill_template(
         template,
         query,
@@ -91,5 +189,33 @@ def build_prompt_with_history(
         **extra,
     )
     if "{history}" in template or not history_text:
-        return base_prompt
-    return f"{history_text}\n{base_prompt}"
+        prompt = base_prompt
+    else:
+        prompt = f"{history_text}\n{base_prompt}"
+    logger.info(
+        f"Prompt built: task={task}, history_messages={kept}/{len(history)}, "
+        f"history_tokens~{estimate_tokens(history_text)}, prompt_tokens~{estimate_tokens(prompt)}"
+    )
+    return prompt
+
+
+def build_repair_prompt(
+    model: str,
+    query: str,
+    sql: str,
+    error: str,
+    *,
+    columns: str,
+    reference_info: str,
+) -> str:
+    """Return a prompt asking ``model`` to fix ``sql`` that failed with ``error``."""
+    template = PROMPT_TEMPLATES.get(model, {}).get("repair", REPAIR_TEMPLATE)
+    prompt = template.format(
+        query=query,
+        sql=sql,
+        error=error.strip()[:REPAIR_ERROR_CHARS],
+        columns=columns,
+        reference_info=reference_info,
+    )
+    logger.info(f"Prompt built: task=repair, prompt_tokens~{estimate_tokens(prompt)}")
+    return prompt
@@ -0,0 +1,109 @@
+"""Size-bounded in-memory cache of query results keyed by canonical SQL."""
+
+from __future__ import annotations
+
+import json
+import re
+import threading
+from collections import OrderedDict
+
+import sql_guard
+
+_READ_ONLY_RE = re.compile(r"^\s*(SELECT|WITH)\b", re.IGNORECASE)
+
+
+def canonicalize_sql(sql: str) -> str:
+    """Return ``sql`` with whitespace collapsed and unquoted text lowercased."""
+    parts = []
+    # Quoted literals/identifiers (E'' and dollar quotes too) are kept verbatim
+    for kind, text in sql_guard.tokenize(sql):
+        if kind == "quoted":
+            parts.append(text)
+        elif kind == "space":
+            parts.append(" ")
+        else:
+            parts.append(text.lower())
+    return "".join(parts).strip().rstrip(";").strip()
+
+
+def is_cacheable(sql: str) -> bool:
+    """Return True for statements whose results may be served from cache."""
+    return bool(_READ_ONLY_RE.match(sql))
+
+
+def estimate_size(value: object) -> int:
+    """Return the approximate JSON size of ``value`` in bytes."""
+    return len(json.dumps(value, default=str))
+
+
+class ResultCache:
+    """LRU cache bounded by the total estimated size of cached results.
+
+    Every entry belongs to a data version (e.g. ``max(data_loaded_at)``);
+    observing a new version drops all entries.
+    """
+
+    def __init__(self, max_bytes: int, max_entry_bytes: int | None = None) -> None:
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes or max_bytes // 4
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._version: object = None
+        self._entries: OrderedDict[str, tuple[object, int]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def version(self) -> object:
+        return self._version
+
+    def set_version(self, version: object) -> None:
+        """Record the current data version, clearing the cache if it changed."""
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self.size = 0
+                self._version = version
+
+    def get(self, key: str) -> object | None:
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def put(self, key: str, results: object, version: object, size: int | None = None) -> None:
+        """Cache ``results`` unless they were read under an outdated version."""
+        if size is None:
+            size = estimate_size(results)
+        if size > self.max_entry_bytes:
+            return
+        with self._lock:
+            if version != self._version:
+                return
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            self._entries[key] = (results, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.size -= evicted_size
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._entries),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "version": None if self._version is None else str(self._version),
+        }
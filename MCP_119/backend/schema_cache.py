@@ -0,0 +1,112 @@
+"""In-memory cache of the schema text used to build SQL prompts."""
+
+import asyncio
+import hashlib
+import os
+import time
+
+import database
+
+SCHEMA_CACHE_TTL = float(os.getenv("SCHEMA_CACHE_TTL", "3600"))
+
+TARGET_TABLE = "emergency_calls"
+TARGET_SCHEMA = "emergence"
+
+# Pre-aggregated tables maintained by the sffd-sync agent
+ROLLUP_TABLES = {
+    "calls_daily": "每日案件數（call_count），依 call_date、call_type、battalion、station_area、priority 分組",
+    "response_times_daily": (
+        "每日反應時間（秒，received_dttm 至 on_scene_dttm），依 call_date、call_type、battalion 分組，"
+        "含 call_count 與 avg/p50/p90_response_seconds；百分位數不可跨日加總"
+    ),
+}
+
+_columns_text: str | None = None
+_reference_info: str | None = None
+_fingerprint = ""
+_loaded_at = 0.0
+_version = 0
+_lock: asyncio.Lock | None = None
+
+
+# Durations computed by the sffd-sync agent at ingest, in seconds
+DERIVED_COLUMNS = {
+    "dispatch_delay_seconds": "received_dttm 至 dispatch_dttm",
+    "travel_seconds": "response_dttm 至 on_scene_dttm",
+    "on_scene_to_transport_seconds": "on_scene_dttm 至 transport_dttm",
+    "response_seconds": "received_dttm 至 on_scene_dttm",
+}
+
+
+def _describe_derived(columns: list[str]) -> str:
+    """Describe the precomputed duration columns present in ``columns``."""
+    parts = [f"{name}（{desc}）" for name, desc in DERIVED_COLUMNS.items() if name in columns]
+    if not parts:
+        return ""
+    return "預先計算的時間欄位（秒，時間順序異常時為 NULL）：" + "、".join(parts)
+
+
+async def _describe_rollups() -> str:
+    """Describe the rollup tables that exist, for use in ``reference_info``."""
+    columns = await asyncio.gather(*(
+        database.get_table_columns_async(name, schema=TARGET_SCHEMA)
+        for name in ROLLUP_TABLES
+    ))
+    parts = [
+        f"{TARGET_SCHEMA}.{name}({', '.join(cols)})：{desc}"
+        for (name, desc), cols in zip(ROLLUP_TABLES.items(), columns)
+        if cols
+    ]
+    if not parts:
+        return ""
+    return "預先彙總表（計數或反應時間統計請優先使用，以 SUM(call_count) 取代 COUNT(*)）：" + "; ".join(parts)
+
+
+def _is_fresh() -> bool:
+    return (
+        _columns_text is not None
+        and time.monotonic() - _loaded_at < SCHEMA_CACHE_TTL
+    )
+
+
+async def get_prompt_context() -> tuple[str, str]:
+    """Return ``(columns_text, reference_info)`` for the SQL prompt templates."""
+    global _columns_text, _reference_info, _fingerprint, _loaded_at, _version, _lock
+    if _is_fresh():
+        return _columns_text, _reference_info
+    if _lock is None:
+        _lock = asyncio.Lock()
+    async with _lock:
+        # Another request may have refreshed the cache while we waited
+        if not _is_fresh():
+            columns = await database.get_table_columns_async(
+                TARGET_TABLE, schema=TARGET_SCHEMA
+            )
+            reference_info = await database.describe_schema_async()
+            extras = [_describe_derived(columns), await _describe_rollups()]
+            reference_info = "\n".join(part for part in [reference_info, *extras] if part)
+            _columns_text = ", ".join(columns)
+            _reference_info = reference_info
+            _fingerprint = hashlib.sha1(
+                f"{_columns_text}\n{reference_info}".encode()
+            ).hexdigest()[:16]
+            _loaded_at = time.monotonic()
+            _version += 1
+    return _columns_text, _reference_info
+
+
+def invalidate() -> None:
+    """Drop the cached schema so the next prompt reloads it."""
+    global _columns_text, _reference_info
+    _columns_text = None
+    _reference_info = None
+
+
+def version() -> int:
+    """Return a counter that increases each time the schema is reloaded."""
+    return _version
+
+
+def fingerprint() -> str:
+    """Return a hash of the cached schema text, stable across reloads."""
+    return _fingerprint
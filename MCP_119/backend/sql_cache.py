@@ -0,0 +1,232 @@
+"""Persistent LRU cache mapping natural language questions to generated SQL."""
+
+from __future__ import annotations
+
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass
+
+SQL_CACHE_ENABLED = os.getenv("SQL_CACHE_ENABLED", "true").lower() not in {"0", "false", "no"}
+SQL_CACHE_PATH = os.getenv("SQL_CACHE_PATH", "sql_cache.db")
+SQL_CACHE_MAX_ENTRIES = int(os.getenv("SQL_CACHE_MAX_ENTRIES", "1000"))
+# Minimum n-gram similarity for a fuzzy hit; 0 disables fuzzy matching
+SQL_CACHE_SIMILARITY = float(os.getenv("SQL_CACHE_SIMILARITY", "0"))
+
+_WS_RE = re.compile(r"\s+")
+_TRAILING_PUNCT = "?？。.!！ "
+_NGRAM = 3
+
+
+def normalize_question(question: str) -> str:
+    """Return a canonical form of ``question`` used for cache keys."""
+    text = unicodedata.normalize("NFKC", question).lower()
+    text = _WS_RE.sub(" ", text).strip()
+    return text.rstrip(_TRAILING_PUNCT)
+
+
+def _ngrams(text: str) -> frozenset[str]:
+    padded = f" {text} "
+    if len(padded) <= _NGRAM:
+        return frozenset({padded})
+    return frozenset(padded[i:i + _NGRAM] for i in range(len(padded) - _NGRAM + 1))
+
+
+@dataclass
+class _Entry:
+    scope: tuple[str, str, str]
+    question: str
+    sql: str
+    grams: frozenset[str]
+
+
+class QuestionSQLCache:
+    """SQLite-backed LRU cache of generated SQL keyed by normalized question.
+
+    Entries are scoped by task, model and schema fingerprint so a schema
+    change or a different model never reuses stale SQL.
+    """
+
+    def __init__(
+        self,
+        db_path: str = SQL_CACHE_PATH,
+        *,
+        max_entries: int = SQL_CACHE_MAX_ENTRIES,
+        similarity_threshold: float = SQL_CACHE_SIMILARITY,
+    ) -> None:
+        self.max_entries = max_entries
+        self.similarity_threshold = similarity_threshold
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, _Entry] = OrderedDict()
+        # last_used of cache hits not yet written to SQLite
+        self._touched: dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._create_table()
+        self._load()
+
+    def _create_table(self) -> None:
+        with self._conn:
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS sql_cache (
+                    key TEXT PRIMARY KEY,
+                    task TEXT,
+                    model TEXT,
+                    schema TEXT,
+                    question TEXT,
+                    sql TEXT,
+                    last_used REAL
+                )
+                """
+            )
+
+    def _load(self) -> None:
+        cur = self._conn.execute(
+            "SELECT key, task, model, schema, question, sql FROM sql_cache "
+            "ORDER BY last_used DESC LIMIT ?",
+            (self.max_entries,),
+        )
+        # Rows arrive most recent first; insert oldest first to keep LRU order
+        for key, task, model, schema, question, sql in reversed(cur.fetchall()):
+            self._entries[key] = _Entry(
+                (task, model, schema), question, sql, _ngrams(question)
+            )
+
+    @staticmethod
+    def _key(scope: tuple[str, str, str], question: str) -> str:
+        return "\x1f".join((*scope, question))
+
+    def get(self, task: str, model: str, schema: str, question: str) -> str | None:
+        """Return cached SQL for ``question`` or None on a miss."""
+        scope = (task, model, schema)
+        normalized = normalize_question(question)
+        key = self._key(scope, normalized)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self.hits += 1
+            elif self.similarity_threshold > 0:
+                entry = self._find_similar(scope, normalized)
+                if entry is not None:
+                    self.similar_hits += 1
+                    key = self._key(scope, entry.question)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._touched[key] = time.time()
+        return entry.sql
+
+    def _find_similar(self, scope: tuple[str, str, str], normalized: str) -> _Entry | None:
+        grams = _ngrams(normalized)
+        best, best_score = None, self.similarity_threshold
+        for entry in self._entries.values():
+            if entry.scope != scope:
+                continue
+            # Jaccard similarity of character n-grams
+            score = len(grams & entry.grams) / len(grams | entry.grams)
+            if score >= best_score:
+                best, best_score = entry, score
+        return best
+
+    def put(self, task: str, model: str, schema: str, question: str, sql: str) -> None:
+        """Store ``sql`` for ``question``, evicting the least recently used entry.
+
+        Writes to SQLite, together with pending hit timestamps; async callers
+        should run it in a worker thread.
+        """
+        scope = (task, model, schema)
+        normalized = normalize_question(question)
+        key = self._key(scope, normalized)
+        evicted: list[str] = []
+        with self._lock:
+            self._entries[key] = _Entry(scope, normalized, sql, _ngrams(normalized))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                evicted.append(self._entries.popitem(last=False)[0])
+            for k in evicted:
+                self._touched.pop(k, None)
+            self._touched.pop(key, None)
+            with self._conn:
+                self._write_touched()
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO sql_cache "
+                    "(key, task, model, schema, question, sql, last_used) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (key, task, model, schema, normalized, sql, time.time()),
+                )
+                self._conn.executemany(
+                    "DELETE FROM sql_cache WHERE key=?", [(k,) for k in evicted]
+                )
+
+    def discard(self, task: str, model: str, schema: str, question: str) -> None:
+        """Remove the entry for ``question``, e.g. when its SQL failed to run."""
+        key = self._key((task, model, schema), normalize_question(question))
+        with self._lock, self._conn:
+            self._entries.pop(key, None)
+            self._touched.pop(key, None)
+            self._conn.execute("DELETE FROM sql_cache WHERE key=?", (key,))
+
+    def _write_touched(self) -> None:
+        # Caller holds the lock and the transaction
+        if self._touched:
+            self._conn.executemany(
+                "UPDATE sql_cache SET last_used=? WHERE key=?",
+                [(ts, key) for key, ts in self._touched.items()],
+            )
+            self._touched.clear()
+
+    def flush(self) -> None:
+        """Write the last_used time of recent hits to SQLite."""
+        with self._lock, self._conn:
+            self._write_touched()
+
+    def clear(self) -> None:
+        """Remove every cached entry."""
+        with self._lock, self._conn:
+            self._entries.clear()
+            self._touched.clear()
+            self._conn.execute("DELETE FROM sql_cache")
+
+    def stats(self) -> dict:
+        """Return hit/miss counters and the current size."""
+        lookups = self.hits + self.similar_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "similar_hits": self.similar_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.similar_hits) / lookups if lookups else 0.0,
+        }
+
+    def close(self) -> None:
+        self.flush()
+        self._conn.close()
+
+
+_default: QuestionSQLCache | None = None
+
+
+def get_default() -> QuestionSQLCache | None:
+    """Return the process-wide cache, or None when caching is disabled."""
+    global _default
+    if not SQL_CACHE_ENABLED:
+        return None
+    if _default is None:
+        _default = QuestionSQLCache()
+    return _default
+
+
+def close_default() -> None:
+    """Flush and close the process-wide cache if it was opened."""
+    global _default
+    if _default is not None:
+        _default.close()
+        _default = None
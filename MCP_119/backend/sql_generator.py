@@ -1,15 +1,17 @@
-import json
+import asyncio
 import os
 import re
-from urllib import request as urlrequest
-from dotenv import load_dotenv
+import database
 import model_router
 import prompt_templates
-import database
+import llm_client
+import schema_cache
+import sql_cache
+import sql_guard
+from logger import logger
 
-load_dotenv(dotenv_path=".env")
-# OLLAMA_URL = os.getenv("OLLAMA_URL", "http://192.168.0.233:11434/api/generate")
-OLLAMA_URL = os.getenv("OLLAMA_URL")
+# Times a failing generated query is sent back to the model; 0 disables repair
+SQL_REPAIR_ATTEMPTS = int(os.getenv("SQL_REPAIR_ATTEMPTS", "1"))
 
 def _llm_enabled() -> bool:
     """Return True if SQL generation via LLM is enabled."""
@@ -48,122 +50,141 @@ def _clean_sql(sql: str) -> str:
     return cleaned_sql
 
 
-def generate_sql(
+async def _generate_for_task(
+    task: str,
     question: str,
     *,
     model: str | None = None,
     history: list | None = None,
 ) -> str:
-    """Generate an SQL query from a natural language question using an LLM."""
+    """Build the prompt for ``task`` and return the SQL produced by the LLM."""
     if not _llm_enabled():
         raise RuntimeError("LLM SQL generation is disabled")
     if model is None:
         model = model_router.ModelRouter().route(task_type="sql")
 
-    columns = database.get_table_columns("emergency_calls", schema="emergence")
-    columns_text = ", ".join(columns)
-    reference_info = database.describe_schema()
+    columns_text, reference_info = await schema_cache.get_prompt_context()
+    # Follow-up questions depend on the conversation, so only standalone
+    # questions are served from the cache
+    cache = sql_cache.get_default() if not history else None
+    if cache is not None:
+        cached = cache.get(task, model, schema_cache.fingerprint(), question)
+        if cached is not None:
+            return cached
     prompt = prompt_templates.build_prompt_with_history(
         model,
-        "sql",
+        task,
         question,
         history or [],
         columns=columns_text,
         reference_info=reference_info,
     )
 
-    req = urlrequest.Request(
-        OLLAMA_URL,
-        data=json.dumps({"model": model, "prompt": prompt, "stream": False}).encode(),
-        headers={"Content-Type": "application/json"},
-        method="POST",
-    )
-    with urlrequest.urlopen(req) as resp:
-        text = resp.read().decode()
-
-    try:
-        data = json.loads(text)
-    except json.JSONDecodeError:
-        # The response may contain multiple JSON objects without a
-        # surrounding array. Decode them sequentially and merge the
-        # "response" fields to reconstruct the full SQL string.
-        decoder = json.JSONDecoder()
-        remaining = text
-        chunks: list[str] = []
-        last_obj: dict | None = None
-        while remaining.strip():
-            try:
-                obj, idx = decoder.raw_decode(remaining.lstrip())
-            except json.JSONDecodeError:
-                break
-            chunks.append(str(obj.get("response", "")))
-            last_obj = obj
-            remaining = remaining.lstrip()[idx:]
-
-        if last_obj is None:
-            raise
-        last_obj["response"] = "".join(chunks)
-        data = last_obj
-    sql = _clean_sql(data.get("response", ""))
+    text = await llm_client.generate(model, prompt)
+    sql = _clean_sql(text)
     if not _is_valid_sql(sql):
         raise ValueError(f"Generated text is not valid SQL: {sql}")
+    # Reject writes before they are cached; execution re-checks with a LIMIT
+    if sql_guard.SQL_GUARD_ENABLED:
+        sql_guard.prepare(sql)
+    if cache is not None:
+        await asyncio.to_thread(cache.put, task, model, schema_cache.fingerprint(), question, sql)
     return sql
 
 
-def generate_chart_sql(
+async def generate_sql(
+    question: str,
+    *,
+    model: str | None = None,
+    history: list | None = None,
+) -> str:
+    """Generate an SQL query from a natural language question using an LLM."""
+    return await _generate_for_task("sql", question, model=model, history=history)
+
+
+async def generate_chart_sql(
     question: str,
     *,
     model: str | None = None,
     history: list | None = None,
 ) -> str:
     """Generate an SQL query for chart comparison using an LLM."""
+    return await _generate_for_task("chart", question, model=model, history=history)
+
+
+async def repair_sql(
+    question: str,
+    sql: str,
+    error: str,
+    *,
+    model: str | None = None,
+) -> str:
+    """Ask the LLM to fix ``sql`` given the database ``error`` it raised."""
     if not _llm_enabled():
         raise RuntimeError("LLM SQL generation is disabled")
     if model is None:
         model = model_router.ModelRouter().route(task_type="sql")
-
-    columns = database.get_table_columns("emergency_calls", schema="emergence")
-    columns_text = ", ".join(columns)
-    reference_info = database.describe_schema()
-    prompt = prompt_templates.build_prompt_with_history(
+    # The schema context is cached, so a repair costs one LLM call only
+    columns_text, reference_info = await schema_cache.get_prompt_context()
+    prompt = prompt_templates.build_repair_prompt(
         model,
-        "chart",
         question,
-        history or [],
+        sql,
+        error,
         columns=columns_text,
         reference_info=reference_info,
     )
+    text = await llm_client.generate(model, prompt)
+    repaired = _clean_sql(text)
+    if not _is_valid_sql(repaired):
+        raise ValueError(f"Repaired text is not valid SQL: {repaired}")
+    if sql_guard.SQL_GUARD_ENABLED:
+        sql_guard.prepare(repaired)
+    return repaired
 
-    req = urlrequest.Request(
-        OLLAMA_URL,
-        data=json.dumps({"model": model, "prompt": prompt, "stream": False}).encode(),
-        headers={"Content-Type": "application/json"},
-        method="POST",
-    )
-    with urlrequest.urlopen(req) as resp:
-        text = resp.read().decode()
-
-    try:
-        data = json.loads(text)
-    except json.JSONDecodeError:
-        decoder = json.JSONDecoder()
-        remaining = text
-        chunks: list[str] = []
-        last_obj: dict | None = None
-        while remaining.strip():
+
+async def execute_with_repair(
+    question: str,
+    sql: str,
+    *,
+    task: str = "sql",
+    model: str | None = None,
+    history: list | None = None,
+) -> tuple[str, database.QueryResult]:
+    """Execute generated ``sql``, repairing it after errors caused by the query.
+
+    Up to ``SQL_REPAIR_ATTEMPTS`` repairs are tried. Returns the SQL that
+    finally ran together with its result; the last error is raised otherwise.
+    """
+    if model is None:
+        model = model_router.ModelRouter().route(task_type="sql")
+    cache = sql_cache.get_default() if not history else None
+    attempts = 0
+    while True:
+        try:
+            result = await database.execute_query_rows_async(sql)
+            break
+        except Exception as exc:
+            if attempts >= SQL_REPAIR_ATTEMPTS or not database.is_query_error(exc):
+                # Never serve SQL that is known to fail from the cache again
+                if cache is not None and database.is_query_error(exc):
+                    await asyncio.to_thread(
+                        cache.discard, task, model, schema_cache.fingerprint(), question
+                    )
+                raise
+            attempts += 1
+            logger.warning(f"{task} SQL failed, repair {attempts}/{SQL_REPAIR_ATTEMPTS}: {exc}")
             try:
-                obj, idx = decoder.raw_decode(remaining.lstrip())
-            except json.JSONDecodeError:
-                break
-            chunks.append(str(obj.get("response", "")))
-            last_obj = obj
-            remaining = remaining.lstrip()[idx:]
-
-        if last_obj is None:
-            raise
-        last_obj["response"] = "".join(chunks)
-        data = last_obj
-    sql = _clean_sql(data.get("response", ""))
-    if not _is_valid_sql(sql):
-        raise ValueError(f"Generated text is not valid SQL: {sql}")
-    return sql
+                sql = await repair_sql(question, sql, str(exc), model=model)
+            except Exception as repair_exc:
+                logger.warning(f"{task} SQL repair failed: {repair_exc}")
+                if cache is not None:
+                    await asyncio.to_thread(
+                        cache.discard, task, model, schema_cache.fingerprint(), question
+                    )
+                raise exc from None
+            logger.info(f"{task} SQL repaired: {sql}")
+    if attempts and cache is not None:
+        # Replace the cached SQL that failed with the version that ran
+        await asyncio.to_thread(cache.put, task, model, schema_cache.fingerprint(), question, sql)
+    return sql, result
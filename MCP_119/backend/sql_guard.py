@@ -0,0 +1,155 @@
+"""Pre-execution checks that keep generated SQL read-only and bounded."""
+
+from __future__ import annotations
+
+import json
+import os
+import re
+
+SQL_GUARD_ENABLED = os.getenv("SQL_GUARD_ENABLED", "true").lower() not in {"0", "false", "no"}
+# Planner cost above which a query is rejected; 0 disables the check
+SQL_GUARD_MAX_COST = float(os.getenv("SQL_GUARD_MAX_COST", "5000000"))
+# Largest row estimate of any plan node; 0 disables the check
+SQL_GUARD_MAX_PLAN_ROWS = float(os.getenv("SQL_GUARD_MAX_PLAN_ROWS", "50000000"))
+# Milliseconds, applied per guarded query with SET LOCAL; 0 leaves the session value
+SQL_GUARD_STATEMENT_TIMEOUT_MS = int(
+    os.getenv("SQL_GUARD_STATEMENT_TIMEOUT_MS", os.getenv("DB_STATEMENT_TIMEOUT_MS", "30000"))
+)
+
+_TOKEN_RE = re.compile(
+    r"""
+      (?P<comment>--[^\n]*|/\*.*?\*/)
+    | (?P<quoted>[eE]'(?:[^'\\]|\\.|'')*'|'(?:[^']|'')*'|"(?:[^"]|"")*"|\$(?P<tag>\w*)\$.*?\$(?P=tag)\$)
+    | (?P<word>[A-Za-z_][A-Za-z0-9_$]*)
+    | (?P<space>\s+)
+    | (?P<other>.)
+    """,
+    re.DOTALL | re.VERBOSE,
+)
+
+_READ_STATEMENTS = {"select", "with"}
+# Keywords that write, lock or change server state anywhere in a statement
+_FORBIDDEN_WORDS = {
+    "insert", "update", "delete", "merge", "upsert", "drop", "alter", "create",
+    "truncate", "grant", "revoke", "copy", "vacuum", "reindex", "cluster", "call",
+    "lock", "into", "refresh", "listen", "notify", "comment", "security",
+}
+# Functions with side effects or that can stall a backend
+_FORBIDDEN_FUNCTIONS = {
+    "pg_sleep", "pg_sleep_for", "pg_sleep_until", "pg_terminate_backend",
+    "pg_cancel_backend", "pg_reload_conf", "pg_rotate_logfile", "pg_read_file",
+    "pg_read_binary_file", "pg_ls_dir", "pg_stat_file", "lo_import", "lo_export",
+    "dblink", "dblink_exec", "set_config", "pg_advisory_lock", "pg_advisory_xact_lock",
+    "nextval", "setval",
+}
+
+
+class SQLGuardError(ValueError):
+    """Raised when a statement is not allowed to run."""
+
+
+def tokenize(sql: str) -> list[tuple[str, str]]:
+    """Split ``sql`` into ``(kind, text)`` pairs.
+
+    ``kind`` is ``comment``, ``quoted`` (string literals including E'' and
+    dollar quotes, and quoted identifiers), ``word``, ``space`` or ``other``.
+    """
+    return [(m.lastgroup, m.group()) for m in _TOKEN_RE.finditer(sql)]
+
+
+def prepare(sql: str, limit: int | None = None) -> str:
+    """Validate ``sql`` and return it without comments, with a LIMIT if missing.
+
+    Raises :class:`SQLGuardError` unless ``sql`` is a single read-only
+    SELECT/WITH statement.
+    """
+    tokens = [t for t in tokenize(sql) if t[0] != "comment"]
+    # Only a trailing semicolon is allowed
+    while tokens and (tokens[-1][0] == "space" or tokens[-1][1] == ";"):
+        tokens.pop()
+    if any(kind == "other" and text == ";" for kind, text in tokens):
+        raise SQLGuardError("Only a single SQL statement is allowed")
+    words = [text.lower() for kind, text in tokens if kind == "word"]
+    if not words or words[0] not in _READ_STATEMENTS:
+        raise SQLGuardError("Only read-only SELECT queries are allowed")
+    if _has_unicode_identifier(tokens):
+        raise SQLGuardError("Unicode escaped identifiers (U&\"...\") are not allowed")
+    # Quoted identifiers name functions too ("pg_sleep"(1)); they are case-sensitive
+    identifiers = [
+        text[1:-1].replace('""', '"')
+        for kind, text in tokens
+        if kind == "quoted" and text.startswith('"')
+    ]
+    forbidden = sorted(
+        set(words + identifiers) & (_FORBIDDEN_WORDS | _FORBIDDEN_FUNCTIONS)
+    )
+    if forbidden:
+        raise SQLGuardError(f"Statement uses disallowed keywords: {', '.join(forbidden)}")
+
+    text = "".join(t for _, t in tokens).strip()
+    if limit is not None and not _has_top_level_limit(tokens):
+        text = f"{text}\nLIMIT {int(limit)}"
+    return text
+
+
+def _has_unicode_identifier(tokens: list[tuple[str, str]]) -> bool:
+    # U&"\0070g_sleep" would hide a name from the identifier check
+    for i in range(len(tokens) - 2):
+        (_, t1), (_, t2), (_, t3) = tokens[i:i + 3]
+        if t1.lower() == "u" and t2 == "&" and t3.startswith('"'):
+            return True
+    return False
+
+
+def _has_top_level_limit(tokens: list[tuple[str, str]]) -> bool:
+    depth = 0
+    for kind, text in tokens:
+        if kind == "other":
+            if text == "(":
+                depth += 1
+            elif text == ")":
+                depth -= 1
+        elif kind == "word" and depth == 0 and text.lower() in {"limit", "fetch"}:
+            return True
+    return False
+
+
+def _walk(node: dict):
+    yield node
+    for child in node.get("Plans", []):
+        yield from _walk(child)
+
+
+def check_plan(cur, sql: str) -> tuple[float, float]:
+    """EXPLAIN ``sql`` and reject it when its estimate exceeds the budget.
+
+    Returns the total cost and the largest row estimate of the plan.
+    """
+    cur.execute("EXPLAIN (FORMAT JSON) " + sql)
+    plan = cur.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    root = plan[0]["Plan"]
+    cost = float(root["Total Cost"])
+    rows = max(float(node.get("Plan Rows", 0)) for node in _walk(root))
+    if SQL_GUARD_MAX_COST > 0 and cost > SQL_GUARD_MAX_COST:
+        raise SQLGuardError(
+            f"Query rejected: estimated cost {cost:,.0f} exceeds the limit of {SQL_GUARD_MAX_COST:,.0f}"
+        )
+    if SQL_GUARD_MAX_PLAN_ROWS > 0 and rows > SQL_GUARD_MAX_PLAN_ROWS:
+        raise SQLGuardError(
+            f"Query rejected: estimated {rows:,.0f} rows exceeds the limit of {SQL_GUARD_MAX_PLAN_ROWS:,.0f}"
+        )
+    return cost, rows
+
+
+def protect(conn, sql: str) -> tuple[float, float]:
+    """Make the current transaction read-only and time-limited, then check the plan.
+
+    Must run before anything else in the transaction that executes ``sql``.
+    """
+    with conn.cursor() as cur:
+        cur.execute("SET TRANSACTION READ ONLY")
+        if SQL_GUARD_STATEMENT_TIMEOUT_MS > 0:
+            cur.execute("SET LOCAL statement_timeout = %s", (SQL_GUARD_STATEMENT_TIMEOUT_MS,))
+        return check_plan(cur, sql)
@@ -1,29 +1,109 @@
 """Utility helpers for the backend."""
 
 import json
+import os
 
 import answer_generator
 
+# "separate": a dedicated summary generation (two LLM calls per request)
+# "combined": summary and answer parsed from one generation
+# "derived": summary is the first sentence of the answer
+SUMMARY_MODES = ("separate", "combined", "derived")
+DEFAULT_SUMMARY_MODE = os.getenv("SUMMARY_MODE", "combined")
 
-def summarize_results(results: list[dict]) -> str:
+
+def summary_mode_for(endpoint: str) -> str:
+    """Return the summary mode for ``endpoint``.
+
+    ``<ENDPOINT>_SUMMARY_MODE`` (e.g. ``ASK_SUMMARY_MODE``) overrides the
+    global ``SUMMARY_MODE`` setting.
+    """
+    return os.getenv(f"{endpoint.upper()}_SUMMARY_MODE", DEFAULT_SUMMARY_MODE)
+
+
+# "rows": a list of objects, one per row
+# "columnar": {"columns": [...], "rows": [[...], ...]} with the header sent once
+RESULT_FORMATS = ("rows", "columnar")
+
+
+def encode_results(query_result, result_format: str = "rows"):
+    """Return a ``database.QueryResult`` in the requested response format."""
+    if result_format == "columnar":
+        return {"columns": query_result.columns, "rows": query_result.rows}
+    return query_result.to_dicts()
+
+
+def serialize_results(query_result) -> str:
+    """Return the compact JSON stored in the conversation context."""
+    return json.dumps(
+        encode_results(query_result, "columnar"), ensure_ascii=False, default=str
+    )
+
+
+async def summarize_results(results: list[dict]) -> str:
     """Return a human friendly summary for query results."""
     if not results:
         return ""
     try:
-        return answer_generator.generate_answer(
+        return await answer_generator.generate_answer(
             "Summarize these query results in one sentence.", results
         )
     except Exception:
         return ""
 
 
-def build_fallback_answer(question: str, results: list[dict]) -> str:
+async def build_fallback_answer(question: str, results: list[dict]) -> str:
     """Return a natural language answer using an LLM as a fallback."""
     if not results:
         return ""
     try:
-        return answer_generator.generate_answer(question, results)
+        return await answer_generator.generate_answer(question, results)
     except Exception:
         return ""
 
 
+async def answer_with_summary(
+    question: str,
+    results: list[dict],
+    reference: list[dict] | None,
+    *,
+    model: str,
+    mode: str | None = None,
+) -> tuple[str, str]:
+    """Return ``(summary, answer)`` for query results using ``mode``.
+
+    ``results`` are the rows just fetched and the summary describes them. The
+    answer is grounded on ``reference``, or on ``results`` when it is None.
+    LLM failures yield empty strings like the handlers did.
+    """
+    mode = mode or DEFAULT_SUMMARY_MODE
+    if mode not in SUMMARY_MODES:
+        raise ValueError(f"Unknown summary mode: {mode}")
+    same = reference is None
+    if same:
+        reference = results
+    # A summary derived from the answer would describe ``reference``
+    if mode == "separate" or (mode == "derived" and not same):
+        summary = await summarize_results(results)
+        try:
+            answer = await answer_generator.generate_answer(
+                question, reference, model=model
+            )
+        except Exception:
+            answer = ""
+        return summary, answer
+    try:
+        if mode == "combined":
+            summary, answer = await answer_generator.generate_combined_answer(
+                question, results, model=model, reference=None if same else reference
+            )
+        else:
+            answer = await answer_generator.generate_answer(
+                question, reference, model=model
+            )
+            summary = answer_generator.derive_summary(answer)
+    except Exception:
+        return "", ""
+    if not results:
+        summary = ""
+    return summary, answer
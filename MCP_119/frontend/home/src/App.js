@@ -7,10 +7,13 @@ import MapContainer from './MapContainer';
 import FinalResponse from './FinalResponse';
 import ModelSelector from './ModelSelector';
 import QuestionInput from './QuestionInput';
+import { toRowObjects } from './results';
 
 function App() {
   const [query, setQuery] = useState('');
   const [result, setResult] = useState(null);
+  // Payload as returned by the API (columnar when requested) for ChartView
+  const [chartData, setChartData] = useState(null);
   const [sql, setSql] = useState('');
   const [summary, setSummary] = useState('');
   const [answer, setAnswer] = useState('');
@@ -85,7 +88,7 @@ const [useHistory, setUseHistory] = useState(true);
     const response = await fetch('/api/sql/execute', {
       method: 'POST',
       headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({ query: querySql, model, question: questionParam, use_history: useHistory })
+      body: JSON.stringify({ query: querySql, model, question: questionParam, use_history: useHistory, result_format: 'columnar' })
     });
     if (!response.ok) {
       const data = await response.json().catch(() => null);
@@ -95,12 +98,14 @@ const [useHistory, setUseHistory] = useState(true);
     const data = await response.json();
     if (data.error) throw new Error(data.error.message || 'Server error');
 
-    const results = data.result?.results || data.results || [];
+    const payload = data.result?.results || data.results;
+    const results = toRowObjects(payload);
     const summaryText = data.result?.summary || data.summary || '';
     const answerText = data.result?.answer || data.answer || '';
     const sqlText = data.result?.sql || querySql;
 
     setResult(results);
+    setChartData(payload);
     setSummary(summaryText);
     setAnswer(answerText);
     setSql(sqlText);
@@ -116,6 +121,7 @@ const [useHistory, setUseHistory] = useState(true);
     setLoading(true);
     setError(null);
     setResult(null);
+    setChartData(null);
     setSql('');
     setSummary('');
     setAnswer('');
@@ -123,18 +129,20 @@ const [useHistory, setUseHistory] = useState(true);
       const resp = await fetch('/api/chart', {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ question: query, model, use_history: useHistory })
+        body: JSON.stringify({ question: query, model, use_history: useHistory, include_base_sql: false, result_format: 'columnar' })
       });
       if (!resp.ok) throw new Error('Failed to generate chart data');
       const data = await resp.json();
       if (data.error) throw new Error(data.error.message || 'Server error');
       const generatedSql = data.result?.sql || data.sql || '';
-      const results = data.result?.results || data.results || [];
+      const payload = data.result?.results || data.results;
+      const results = toRowObjects(payload);
       const summaryText = data.result?.summary || data.summary || '';
       const answerText = data.result?.answer || data.answer || '';
 
       setSql(generatedSql);
       setResult(results);
+      setChartData(payload);
       setSummary(summaryText);
       setAnswer(answerText);
 
@@ -151,6 +159,7 @@ const [useHistory, setUseHistory] = useState(true);
     setLoading(true);
     setError(null);
     setResult(null);
+    setChartData(null);
     setSummary('');
     setAnswer('');
     try {
@@ -166,6 +175,7 @@ const [useHistory, setUseHistory] = useState(true);
     setQuery(item.question || '');
     setSql(item.sql || '');
     setResult(item.result || null);
+    setChartData(item.result || null);
     setSummary(item.summary || '');
     setAnswer(item.answer || '');
     if (item.model) {
@@ -262,7 +272,7 @@ const [useHistory, setUseHistory] = useState(true);
             )}
             {activeTab === 'chart' && (
               <div className="space-y-4">
-            {Array.isArray(result) && result.length > 0 && <ChartView result={result} />}
+            {Array.isArray(result) && result.length > 0 && <ChartView result={chartData} />}
           </div>
         )}
             {activeTab === 'map' && (
@@ -10,16 +10,36 @@ import {
   Legend,
 } from 'chart.js';
 
+import { isColumnar } from './results';
+
 ChartJS.register(CategoryScale, LinearScale, BarElement, Title, Tooltip, Legend);
 
-function ChartView({ result }) {
+// Return [labelKey, dataKey, labels, values] for row objects or columnar results.
+function extractSeries(result) {
+  if (isColumnar(result)) {
+    if (result.columns.length < 2 || result.rows.length === 0) return null;
+    return [
+      result.columns[0],
+      result.columns[1],
+      result.rows.map((r) => String(r[0])),
+      result.rows.map((r) => Number(r[1])),
+    ];
+  }
   if (!Array.isArray(result) || result.length === 0) return null;
   const keys = Object.keys(result[0]);
   if (keys.length < 2) return null;
-  const labelKey = keys[0];
-  const dataKey = keys[1];
-  const labels = result.map((r) => String(r[labelKey]));
-  const data = result.map((r) => Number(r[dataKey]));
+  return [
+    keys[0],
+    keys[1],
+    result.map((r) => String(r[keys[0]])),
+    result.map((r) => Number(r[keys[1]])),
+  ];
+}
+
+function ChartView({ result }) {
+  const series = extractSeries(result);
+  if (!series) return null;
+  const [, dataKey, labels, data] = series;
   if (data.some((n) => Number.isNaN(n))) return null;
   const chartData = {
     labels,
@@ -0,0 +1,12 @@
+// Query results arrive either as an array of row objects or, when requested
+// with result_format: 'columnar', as { columns: [...], rows: [[...], ...] }.
+export function isColumnar(results) {
+  return Boolean(results) && Array.isArray(results.columns) && Array.isArray(results.rows);
+}
+
+export function toRowObjects(results) {
+  if (Array.isArray(results)) return results;
+  if (!isColumnar(results)) return [];
+  const { columns, rows } = results;
+  return rows.map((row) => Object.fromEntries(columns.map((col, i) => [col, row[i]])));
+}
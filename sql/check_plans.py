@@ -0,0 +1,147 @@
+"""查詢計畫回歸檢查：對代表性的模型產生 SQL 執行 EXPLAIN，確認分割裁剪與索引仍然有效。
+
+用法：PG_DSN=postgresql://... python sql/check_plans.py [--verbose]
+
+* max_partitions：計畫中掃描的月分割表數量上限（分割裁剪）。
+* index：在 enable_seqscan=off 下重新規劃，分割表上不得出現 Seq Scan，
+  代表確實有索引能服務該查詢（索引被移除或失效時會失敗）。
+
+任一檢查失敗時以非零狀態碼結束，套用 migration 或調整索引後執行。
+"""
+import argparse
+import json
+import os
+import re
+import sys
+
+import psycopg2
+
+PG_DSN = os.getenv("PG_DSN")
+TABLE = "emergence.emergency_calls"
+PARTITION_RE = re.compile(r"^emergency_calls_\d{6}$")
+
+CASES = [
+    {
+        "name": "單月依 call_type 計數",
+        "sql": f"""
+            SELECT call_type, COUNT(*) AS count FROM {TABLE}
+            WHERE call_date >= '2025-04-01' AND call_date < '2025-05-01'
+            GROUP BY call_type ORDER BY count DESC LIMIT 100
+        """,
+        "max_partitions": 1,
+    },
+    {
+        "name": "近七日每日案件數",
+        "sql": f"""
+            SELECT call_date, COUNT(*) FROM {TABLE}
+            WHERE call_date >= CURRENT_DATE - 7
+            GROUP BY call_date ORDER BY call_date LIMIT 100
+        """,
+        "max_partitions": 2,
+    },
+    {
+        "name": "單一案件查詢",
+        "sql": f"SELECT * FROM {TABLE} WHERE call_number = '250000001' LIMIT 100",
+        "index": True,
+    },
+    {
+        "name": "最新 data_loaded_at",
+        "sql": f"SELECT max(data_loaded_at) FROM {TABLE}",
+        "index": True,
+    },
+    {
+        "name": "單一大隊單月案件",
+        "sql": f"""
+            SELECT call_date, call_type, COUNT(*) FROM {TABLE}
+            WHERE battalion = 'B02' AND call_date BETWEEN '2025-04-01' AND '2025-04-30'
+            GROUP BY call_date, call_type LIMIT 100
+        """,
+        "max_partitions": 1,
+        "index": True,
+    },
+    {
+        "name": "依 priority 統計單月案件",
+        "sql": f"""
+            SELECT priority, COUNT(*) FROM {TABLE}
+            WHERE priority = '3' AND call_date >= '2025-03-01' AND call_date < '2025-04-01'
+            GROUP BY priority
+        """,
+        "max_partitions": 1,
+        "index": True,
+    },
+    {
+        "name": "反應時間超過 20 分鐘的案件",
+        "sql": f"""
+            SELECT call_number, battalion, response_seconds FROM {TABLE}
+            WHERE response_seconds > 1200 ORDER BY response_seconds DESC LIMIT 100
+        """,
+        "index": True,
+    },
+    {
+        "name": "單日 received_dttm 區間",
+        "sql": f"""
+            SELECT unit_id, received_dttm, on_scene_dttm FROM {TABLE}
+            WHERE received_dttm >= '2025-05-01' AND received_dttm < '2025-05-02'
+            LIMIT 100
+        """,
+        "index": True,
+    },
+]
+
+
+def walk(node):
+    yield node
+    for child in node.get("Plans", []):
+        yield from walk(child)
+
+
+def explain(conn, sql, seqscan=True):
+    with conn.cursor() as cur:
+        cur.execute("SET LOCAL enable_seqscan = %s", ("on" if seqscan else "off",))
+        cur.execute("EXPLAIN (FORMAT JSON) " + sql)
+        plan = cur.fetchone()[0]
+    conn.rollback()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]["Plan"]
+
+
+def check(conn, case, verbose=False):
+    """回傳 (是否通過, 說明)"""
+    problems = []
+    plan = explain(conn, case["sql"])
+    partitions = {n["Relation Name"] for n in walk(plan) if PARTITION_RE.match(n.get("Relation Name", ""))}
+    detail = f"partitions={len(partitions)} cost={plan['Total Cost']:.0f} rows={plan['Plan Rows']}"
+    limit = case.get("max_partitions")
+    if limit is not None and len(partitions) > limit:
+        problems.append(f"掃描 {len(partitions)} 個分割表（上限 {limit}）")
+    if case.get("index"):
+        forced = explain(conn, case["sql"], seqscan=False)
+        seq = sorted({
+            n["Relation Name"] for n in walk(forced)
+            if n["Node Type"] == "Seq Scan" and PARTITION_RE.match(n.get("Relation Name", ""))
+        })
+        if seq:
+            problems.append(f"無可用索引（Seq Scan：{', '.join(seq[:3])}{'…' if len(seq) > 3 else ''}）")
+        if verbose:
+            detail += " | " + ", ".join(sorted({n["Node Type"] for n in walk(forced)}))
+    return not problems, detail + ("; " + "; ".join(problems) if problems else "")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query plan regression checks for emergency_calls")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    failed = 0
+    with psycopg2.connect(PG_DSN) as conn:
+        for case in CASES:
+            ok, detail = check(conn, case, args.verbose)
+            failed += not ok
+            print(f"[{'PASS' if ok else 'FAIL'}] {case['name']}: {detail}")
+    print(f"[INFO] {len(CASES) - failed}/{len(CASES)} passed")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+-- emergence.emergency_calls：唯一鍵、依 call_date 每月分割、BRIN / B-tree 索引
+--
+-- 用法：psql "$PG_DSN" -f sql/migrations/001_emergency_calls_keys_partitions.sql
+--
+-- * 分割表的唯一鍵必須包含分割鍵，因此主鍵為 (call_number, unit_id, call_date)；
+--   同一通報的 call_date 不會改變，效果等同 (call_number, unit_id)。
+-- * 舊表改名為 emergency_calls_unpartitioned 保留，確認無誤後再自行 DROP。
+-- * 主鍵欄位為 NULL 的資料無法放入分割表，會被略過；重複主鍵只保留 data_loaded_at 最新的一筆。
+
+BEGIN;
+
+ALTER TABLE emergence.emergency_calls RENAME TO emergency_calls_unpartitioned;
+
+CREATE TABLE emergence.emergency_calls
+    (LIKE emergence.emergency_calls_unpartitioned INCLUDING DEFAULTS)
+    PARTITION BY RANGE (call_date);
+
+ALTER TABLE emergence.emergency_calls
+    ALTER COLUMN call_number SET NOT NULL,
+    ALTER COLUMN unit_id SET NOT NULL,
+    ALTER COLUMN call_date SET NOT NULL;
+
+-- 建立 d 所在月份的分割表（已存在則略過），sffd_sync.py 寫入前會呼叫
+CREATE OR REPLACE FUNCTION emergence.ensure_emergency_calls_partition(d date)
+RETURNS void LANGUAGE plpgsql AS $$
+DECLARE
+    start_date date := date_trunc('month', d)::date;
+    part text := 'emergency_calls_' || to_char(start_date, 'YYYYMM');
+BEGIN
+    IF to_regclass('emergence.' || part) IS NULL THEN
+        EXECUTE format(
+            'CREATE TABLE emergence.%I PARTITION OF emergence.emergency_calls FOR VALUES FROM (%L) TO (%L)',
+            part, start_date, (start_date + interval '1 month')::date
+        );
+    END IF;
+END
+$$;
+
+SELECT emergence.ensure_emergency_calls_partition(m::date)
+FROM generate_series(
+    date_trunc('month', (SELECT min(call_date) FROM emergence.emergency_calls_unpartitioned)),
+    date_trunc('month', (SELECT max(call_date) FROM emergence.emergency_calls_unpartitioned)),
+    interval '1 month'
+) AS m;
+SELECT emergence.ensure_emergency_calls_partition(current_date);
+SELECT emergence.ensure_emergency_calls_partition((current_date + interval '1 month')::date);
+
+INSERT INTO emergence.emergency_calls
+SELECT DISTINCT ON (call_number, unit_id, call_date) *
+FROM emergence.emergency_calls_unpartitioned
+WHERE call_number IS NOT NULL AND unit_id IS NOT NULL AND call_date IS NOT NULL
+ORDER BY call_number, unit_id, call_date, data_loaded_at DESC NULLS LAST;
+
+-- 索引於匯入後建立，建立在父表上會自動套用到每個分割表（含之後新增的）
+ALTER TABLE emergence.emergency_calls
+    ADD CONSTRAINT emergency_calls_pkey PRIMARY KEY (call_number, unit_id, call_date);
+
+-- 時間欄位大致依寫入順序遞增，BRIN 體積極小且適合範圍查詢
+CREATE INDEX emergency_calls_call_date_brin ON emergence.emergency_calls USING brin (call_date);
+CREATE INDEX emergency_calls_received_dttm_brin ON emergence.emergency_calls USING brin (received_dttm);
+CREATE INDEX emergency_calls_on_scene_dttm_brin ON emergence.emergency_calls USING brin (on_scene_dttm);
+-- max(data_loaded_at) 由同步程式與後端結果快取頻繁查詢，需用 B-tree
+CREATE INDEX emergency_calls_data_loaded_at_idx ON emergence.emergency_calls (data_loaded_at);
+
+-- 常用的分組 / 篩選欄位，附帶 call_date 以支援「某分類 + 日期區間」查詢
+CREATE INDEX emergency_calls_call_type_idx ON emergence.emergency_calls (call_type, call_date);
+CREATE INDEX emergency_calls_battalion_idx ON emergence.emergency_calls (battalion, call_date);
+CREATE INDEX emergency_calls_station_area_idx ON emergence.emergency_calls (station_area, call_date);
+CREATE INDEX emergency_calls_priority_idx ON emergence.emergency_calls (priority, call_date);
+
+COMMIT;
+
+ANALYZE emergence.emergency_calls;
+
+-- DROP TABLE emergence.emergency_calls_unpartitioned;
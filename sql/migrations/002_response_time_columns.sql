@@ -0,0 +1,33 @@
+-- emergence.emergency_calls：預先計算的反應時間欄位（秒）
+--
+-- 用法：psql "$PG_DSN" -f sql/migrations/002_response_time_columns.sql
+--
+-- 新資料由 sffd_sync.py 匯入時計算；此檔只負責新增欄位、回補既有資料並建立索引。
+-- 時間戳記順序錯誤（差值為負）時存為 NULL。
+
+BEGIN;
+
+ALTER TABLE emergence.emergency_calls
+    ADD COLUMN IF NOT EXISTS dispatch_delay_seconds DOUBLE PRECISION,          -- received_dttm → dispatch_dttm
+    ADD COLUMN IF NOT EXISTS travel_seconds DOUBLE PRECISION,                  -- response_dttm → on_scene_dttm
+    ADD COLUMN IF NOT EXISTS on_scene_to_transport_seconds DOUBLE PRECISION,   -- on_scene_dttm → transport_dttm
+    ADD COLUMN IF NOT EXISTS response_seconds DOUBLE PRECISION;                -- received_dttm → on_scene_dttm
+
+UPDATE emergence.emergency_calls SET
+    dispatch_delay_seconds = CASE WHEN dispatch_dttm >= received_dttm
+        THEN extract(epoch FROM dispatch_dttm - received_dttm) END,
+    travel_seconds = CASE WHEN on_scene_dttm >= response_dttm
+        THEN extract(epoch FROM on_scene_dttm - response_dttm) END,
+    on_scene_to_transport_seconds = CASE WHEN transport_dttm >= on_scene_dttm
+        THEN extract(epoch FROM transport_dttm - on_scene_dttm) END,
+    response_seconds = CASE WHEN on_scene_dttm >= received_dttm
+        THEN extract(epoch FROM on_scene_dttm - received_dttm) END;
+
+CREATE INDEX IF NOT EXISTS emergency_calls_dispatch_delay_idx ON emergence.emergency_calls (dispatch_delay_seconds);
+CREATE INDEX IF NOT EXISTS emergency_calls_travel_idx ON emergence.emergency_calls (travel_seconds);
+CREATE INDEX IF NOT EXISTS emergency_calls_on_scene_to_transport_idx ON emergence.emergency_calls (on_scene_to_transport_seconds);
+CREATE INDEX IF NOT EXISTS emergency_calls_response_idx ON emergence.emergency_calls (response_seconds);
+
+COMMIT;
+
+ANALYZE emergence.emergency_calls;
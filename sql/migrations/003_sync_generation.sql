@@ -0,0 +1,13 @@
+-- emergence.sync_generation：資料版本計數器，供後端查詢結果快取判斷是否失效
+--
+-- 用法：psql "$PG_DSN" -f sql/migrations/003_sync_generation.sql
+--
+-- sffd_sync.py 在每批資料與每次彙總表重算的同一交易中將 generation 加一，
+-- 因此彙總表更新完成後版本一定會再改變一次，快取不會保留重算前的結果。
+-- sffd_sync.py 首次執行時也會自動建立此表。
+
+CREATE TABLE IF NOT EXISTS emergence.sync_generation (
+    job TEXT PRIMARY KEY,
+    generation BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);